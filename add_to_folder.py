@@ -1,5 +1,5 @@
 #
-# Adds a song or album to a folder
+# Adds songs or albums to a folder
 # MusicApp database.
 #
 
@@ -7,9 +7,18 @@ import json
 import boto3
 import os
 import datatier
-import requests
+import settings
+import db_utils
+import auth_utils
+import api_utils
+import spotify_utils
+
+
+#
+# most musicids accepted in one request:
+#
+MAX_BATCH_SIZE = int(os.getenv("MAX_FOLDER_BATCH_SIZE", "500"))
 
-from configparser import ConfigParser
 
 def lambda_handler(event, context):
   try:
@@ -17,13 +26,10 @@ def lambda_handler(event, context):
     print("**lambda: proj03_users**")
     
     #
-    # setup AWS based on config file:
+    # configuration, read once per container (see
+    # settings.py):
     #
-    config_file = 'musicapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
+    config = settings.get()
     
     #
     # configure for S3 access:
@@ -36,21 +42,16 @@ def lambda_handler(event, context):
     #s3 = boto3.resource('s3')
     #bucket = s3.Bucket(bucketname)
     
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
 
   
     #
-    # the user has sent us 2 parameters:
+    # the user has sent us 3 parameters, plus 1 optional:
     #  1. token
     #  2. folder_id
-    #  3. music_id
+    #  3. music_id (a Spotify id, URI or URL), or musicids,
+    #     a list of them (at most MAX_BATCH_SIZE)
+    #  4. kind ("track" or "album", optional if the
+    #     music_id is a Spotify URI or URL)
     #
     # The parameters are coming through web server 
     # (or API Gateway) in the body of the request
@@ -63,49 +64,73 @@ def lambda_handler(event, context):
       
     body = json.loads(event["body"]) # parse the json
     
-    if "token" not in body:
+    if "token" not in body and auth_utils.authorized_userid(event) is None:
       raise Exception("event has a body but no token")
       
     if "folderid" not in body:
       raise Exception("event has a body but no folder id")
-    if "musicid" not in body:
+    if "musicid" not in body and "musicids" not in body:
       raise Exception("event has a body but no music id")
 
-    token = body["token"]
+    token = body.get("token")
     folderid = body["folderid"]
-    musicid = body["musicid"]
+    
+    if "musicids" in body:
+      requested = body["musicids"]
+      
+      if not isinstance(requested, list) or len(requested) == 0:
+        raise Exception("musicids must be a non-empty list")
+      
+      if len(requested) > MAX_BATCH_SIZE:
+        return api_utils.error(400, f"at most {MAX_BATCH_SIZE} musicids per request")
+    else:
+      requested = [body["musicid"]]
     
     #
-    # is the token valid? Ask the authentication service...
+    # (musicid, kind) pairs, without repeats:
     #
-    auth_url = configur.get('auth', 'webservice')
-    data = {"token": token}
+    music = {}
+    for value in requested:
+      try:
+        musicid, kind = spotify_utils.parse_music_id(value, body.get("kind"))
+      except ValueError as err:
+        return api_utils.error(400, str(err))
+      music[musicid] = kind
     
-    api = '/auth'
-    url = auth_url + api
-    
-    response = requests.post(url, json=data)
+    #
+    # requests that came through the authorizer already
+    # carry the userid; otherwise turn away recently
+    # rejected tokens before doing any database work:
+    #
+    userid = auth_utils.authorized_userid(event)
     
-    if response.status_code != 200:
-      msg = "authentication failure"
-      print("**ERROR:", msg)
-      return api_utils.error(401, msg)
+    if userid is None:
+      try:
+        auth_utils.check_token(token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return api_utils.error(401, msg)
     
-
     #
     # open connection to the database:
     #
     print("**Opening connection**")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
     
     
     #
-    # retrieve userid from tokens
+    # is the token valid? Check it against the tokens table,
+    # which also tells us who the user is:
     #
-    user_sql = "SELECT userid FROM tokens WHERE token = %s"
-    user_info = datatier.retrieve_one_row(dbConn, user_sql, token)
-    userid = user_info[0]
+    if userid is None:
+      try:
+        (userid, expiration_utc) = auth_utils.validate_token(dbConn, token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return api_utils.error(401, msg)
     
     
     #
@@ -114,19 +139,26 @@ def lambda_handler(event, context):
     print("**Retrieving data**")
 
     #
-    # insert into folder_music
+    # insert into folder_music, all in one statement; music
+    # already in the folder is left as is, so retries are
+    # safe. Unlike INSERT IGNORE this still fails on a bad
+    # folderid or an over-long value. A no-op update counts
+    # as 0 affected rows, so modified is the number added:
     #
-    sql = """
-          INSERT INTO folder_music (folderid, musicid)
-          VALUES (%s, %s)
+    placeholders = ", ".join(["(%s, %s, %s)"] * len(music))
+    
+    sql = f"""
+          INSERT INTO folder_music (folderid, musicid, kind)
+          VALUES {placeholders}
+          ON DUPLICATE KEY UPDATE folderid = folderid
           """
-    folder_info = [folderid, musicid]
+    folder_info = []
+    for (musicid, kind) in music.items():
+      folder_info += [folderid, musicid, kind]
     
     modified = datatier.perform_action(dbConn, sql, folder_info)
     
-    if modified != 1:
-      print("**INTERNAL ERROR: insert into database failed...**")
-      return api_utils.error(400, "INTERNAL ERROR: insert failed to modify database")
+    print("added", modified, "of", len(music), "musicids")
     
     #
     # respond in an HTTP-like way, i.e. with a status
@@ -136,7 +168,9 @@ def lambda_handler(event, context):
     
     return {
       'statusCode': 200,
-      'body': json.dumps({"message": "Music added to folder successfully"})
+      'body': json.dumps({"message": "Music added to folder successfully",
+                          "added": modified,
+                          "already_present": len(music) - modified})
     }
     
   except Exception as err:
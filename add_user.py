@@ -7,9 +7,16 @@ import json
 import boto3
 import os
 import datatier
-import auth
+import settings
+import db_utils
+import passwords
+
+
+#
+# email check, also EXPLAINed by check_query_plans.py:
+#
+EXISTING_USER_SQL = "SELECT * FROM users WHERE email = %s"
 
-from configparser import ConfigParser
 
 def lambda_handler(event, context):
   try:
@@ -18,13 +25,10 @@ def lambda_handler(event, context):
 
     
     #
-    # setup AWS based on config file:
+    # configuration, read once per container (see
+    # settings.py):
     #
-    config_file = 'musicapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
+    config = settings.get()
     
     #
     # configure for S3 access:
@@ -37,14 +41,6 @@ def lambda_handler(event, context):
     #s3 = boto3.resource('s3')
     #bucket = s3.Bucket(bucketname)
     
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
 
 
     #
@@ -96,14 +92,13 @@ def lambda_handler(event, context):
     #
     print("**Opening connection**")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
     
 
     #
     # check is user email is already in use in database
     #
-    existing_user_sql = "SELECT * FROM users WHERE email = %s"
-    existing_user = datatier.retrieve_one_row(dbConn, existing_user_sql, email)
+    existing_user = datatier.retrieve_one_row(dbConn, EXISTING_USER_SQL, email)
     # if email in use, print something and return out of function
     if existing_user:
       return {
@@ -125,7 +120,7 @@ def lambda_handler(event, context):
         INSERT INTO users (username, pwdhash, first_name, last_name, email)
         VALUES (%s, %s, %s, %s, %s);
         """
-    hashpass = auth.hash_password(pwd)
+    hashpass = passwords.hash_password(pwd)
     
     user_data = [username, hashpass, first_name, last_name, email]
     
@@ -9,18 +9,36 @@
 # { "body": { "username": "...", "password": "..." } }
 #
 # If a token is passed, the function returns 200 if the 
-# token is still valid, and 401 if not. If a username/pwd
+# token is still valid --- along with the token's userid
+# and expiration_utc --- and 401 if not. Posting
+# { "token": "...", "revoke": true } revokes the token, and
+# { "token": "...", "refresh": true } extends a still-valid
+# token by "duration" minutes (see below) --- returning the
+# token to use from now on and its new expiration_utc ---
+# without another password check. If a username/pwd
 # is passed, the function returns 200 --- and a token ---
 # if the username exists and the password matches. Otherwise
 # 401 is returned.
 #
-# When passing username/password, an optional "duration" can
+# When passing username/password or refreshing, an optional "duration" can
 # be posted, which is the duration in minutes for the token
 # before it expires --- passing small values like 1 or 2 is
 # good for testing. The default is 30 minutes, and at most
 # the caller can set the duration to 60 minutes. Values < 1
 # or > 60 are ignored.
 #
+# authorizer_handler is a second entry point, for use as an
+# API Gateway lambda authorizer in front of the other
+# functions. It validates the caller's token once and
+# returns an allow policy whose context carries the userid,
+# which handlers read back with
+# auth_utils.authorized_userid(event).
+#
+# If SESSION_ACTIVE_KEY is configured, the tokens issued
+# are signed tokens (see session_tokens.py) that any lambda
+# can verify without a database read; otherwise they are
+# uuids stored in the tokens table.
+#
 # Original author: Dilan Nair
 # Modifed by: Prof. Joe Hummel
 # Northwestern University
@@ -30,11 +48,54 @@ import json
 import os
 import datetime
 import uuid
+import time
 import datatier
-import auth
+import settings
+import db_utils
+import passwords
 import api_utils
+import auth_utils
+import session_tokens
+import ttl_cache
+
+#
+# login query, also EXPLAINed by check_query_plans.py:
+#
+LOGIN_SQL = "SELECT userid, pwdhash FROM users WHERE username = %s;"
+
+#
+# authorizer results by token hash, kept across warm
+# invocations. Cache hits are still checked against the
+# revoked token set, so a token revoked in another
+# container is denied within REVOCATION_REFRESH seconds;
+# entries live no longer than that by default:
+#
+authorizer_cache = ttl_cache.get_cache("authorizer",
+                                       int(os.getenv("AUTHORIZER_CACHE_SIZE", "1024")),
+                                       int(os.getenv("AUTHORIZER_CACHE_TTL", str(auth_utils.REVOCATION_REFRESH))))
+
+
+def _duration(body):
+  #
+  # did they pass a duration for the token? It's optional,
+  # both at login and when refreshing a token, and only
+  # read there; raises ValueError or TypeError if it is
+  # not a number:
+  #
+  duration = 30 # minutes (default) before token expires
+  
+  if "duration" in body:
+    #
+    # if within range, override default:
+    #
+    requested_duration = int(body["duration"])
+    if 1 <= requested_duration <= 60:
+      duration = requested_duration
+  
+  print("duration:", duration)
+  
+  return duration
 
-from configparser import ConfigParser
 
 def lambda_handler(event, context):
   try:
@@ -42,30 +103,11 @@ def lambda_handler(event, context):
     print("**lambda: proj04_auth**")
 
     #
-    # setup AWS based on config file
+    # configuration, read once per container (see
+    # settings.py):
     #
-    config_file = 'benfordapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+    config = settings.get('benfordapp-config.ini')
     
-    configur = ConfigParser()
-    configur.read(config_file)
-    
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
-    
-    #
-    # open connection to the database
-    #
-    print("**Opening connection**")
-    
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
-
     #
     # We are expecting either a token, or username/password:
     #
@@ -88,6 +130,24 @@ def lambda_handler(event, context):
     else:
       return api_utils.error(400, "missing credentials in body")
       
+    #
+    # a token we recently turned away is rejected again
+    # without touching the database:
+    #
+    if token != "":
+      try:
+        auth_utils.check_token(token)
+      except auth_utils.AuthError as err:
+        print("**Token is not valid, returning...**", str(err))
+        return api_utils.error(401, str(err))
+    
+    #
+    # open connection to the database:
+    #
+    print("**Opening connection**")
+    
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
+
     #
     # if we were passed a token, lookup in the database and
     # see if exists, and still valid:
@@ -99,42 +159,55 @@ def lambda_handler(event, context):
       print("**We were passed a token**")
       print("token:", token)
       
-      print("**Looking up token in database**")
+      #
+      # refresh: extend the token's expiration with one write,
+      # no password check and no new tokens row:
+      #
+      if body.get("refresh"):
+        print("**Refreshing token**")
+        
+        try:
+          duration = _duration(body)
+        except (ValueError, TypeError):
+          return api_utils.error(400, "duration must be a whole number of minutes")
+        
+        expiration_utc = datetime.datetime.utcnow() + datetime.timedelta(minutes=duration)
+        
+        try:
+          token = auth_utils.refresh_token(dbConn, token, expiration_utc)
+        except auth_utils.AuthError as err:
+          print("**Token is not valid, returning...**", str(err))
+          return api_utils.error(401, str(err))
+        
+        print("**DONE, returning refreshed token**")
+        
+        return api_utils.success(200, {"token": token,
+                                       "expiration_utc": expiration_utc.isoformat()})
       
-      sql = "SELECT userid, expiration_utc FROM tokens WHERE token = %s;"
-
-      row = datatier.retrieve_one_row(dbConn, sql, [token])
-
-      if row == ():
-        print("**No such token, returning...**")
-        return api_utils.error(401, "invalid token")
+      print("**Looking up token in database**")
       
-      userid = row[0]
-      expiration_utc = row[1]
+      try:
+        (userid, expiration_utc) = auth_utils.validate_token(dbConn, token)
+      except auth_utils.AuthError as err:
+        print("**Token is not valid, returning...**", str(err))
+        return api_utils.error(401, str(err))
       
       print("userid", userid)
       print("expiration_utc:", expiration_utc)
       
+      if body.get("revoke"):
+        print("**Revoking token**")
+        auth_utils.revoke_token(dbConn, token)
+        return api_utils.success(200, "token revoked")
+      
       #
-      # has token expired?
+      # not expired, still valid; return who the token
+      # belongs to so callers don't have to look it up again:
       #
-      print("**Has token expired?**")
-      
-      utc_now = datetime.datetime.utcnow()
-      print("utc_now:", utc_now)
-      
-      if utc_now < expiration_utc: 
-        #
-        # not expired, still valid:
-        #
-        print("**Token STILL VALID, returning success**")
-        return api_utils.success(200, "valid token")
-      else:
-        #
-        # expired:
-        #
-        print("**Token HAS EXPIRED, returning invalid token**")
-        return api_utils.error(401, "expired token")
+      print("**Token STILL VALID, returning success**")
+      return api_utils.success(200, {"message": "valid token",
+                                     "userid": userid,
+                                     "expiration_utc": expiration_utc.isoformat()})
     
     #
     # we were passed username/password, authenticate
@@ -144,26 +217,14 @@ def lambda_handler(event, context):
     print("username:", username)
     print("password:", password)
     
-    #
-    # did they pass a duration for the token? It's optional:
-    #
-    duration = 30 # minutes (default) before token expires
+    try:
+      duration = _duration(body)
+    except (ValueError, TypeError):
+      return api_utils.error(400, "duration must be a whole number of minutes")
     
-    if "duration" in body:
-      #
-      # if within range, override default:
-      #
-      requested_duration = int(body["duration"])
-      if 1 <= requested_duration <= 60:
-        duration = requested_duration
-    
-    print("duration:", duration)
-      
     print("**Looking up user**")
       
-    sql = "SELECT userid, pwdhash FROM users WHERE username = %s;"
-
-    row = datatier.retrieve_one_row(dbConn, sql, [username])
+    row = datatier.retrieve_one_row(dbConn, LOGIN_SQL, [username])
 
     if row == ():
       print("**No such user, returning...**")
@@ -178,9 +239,30 @@ def lambda_handler(event, context):
     #
     # hash user's password and check for a match:
     #
-    if not auth.check_password(password, pwdhash):
+    start = time.perf_counter()
+    
+    if not passwords.check_password(password, pwdhash):
       print("**Password is NOT correct, returning...**")
       return api_utils.error(401, "invalid password")
+    
+    print("check_password ms:", round((time.perf_counter() - start) * 1000, 1))
+    
+    #
+    # the hash is a legacy one, or was made at a different
+    # cost than we now use; we know the password, so store a
+    # fresh bcrypt hash. Only replace the hash we checked, in
+    # case the password was changed meanwhile, and never
+    # fail the login over it:
+    #
+    if passwords.needs_rehash(pwdhash):
+      print("**Rehashing password at cost", passwords.HASH_COST, "**")
+      
+      try:
+        sql = "UPDATE users SET pwdhash = %s WHERE userid = %s AND pwdhash = %s;"
+        
+        datatier.perform_action(dbConn, sql, [passwords.hash_password(password), userid, pwdhash])
+      except Exception as err:
+        print("**WARNING: rehash failed:", str(err))
       
     #
     # password matches, generate a token and return it:
@@ -188,6 +270,20 @@ def lambda_handler(event, context):
     print("**Password is correct**")
     print("**Generating access token**")
 
+    expiration_utc = datetime.datetime.utcnow() + datetime.timedelta(minutes=duration)
+    
+    #
+    # signed tokens are verified without the database, so
+    # there is nothing to store:
+    #
+    if session_tokens.enabled():
+      token = session_tokens.issue(userid, expiration_utc)
+      
+      print("token:", token)
+      print("**DONE, returning signed token**")
+      
+      return api_utils.success(200, token)
+
     token = str(uuid.uuid4())
     
     print("token:", token)
@@ -197,8 +293,6 @@ def lambda_handler(event, context):
     #
     print("**Inserting token into database**")
     
-    expiration_utc = datetime.datetime.utcnow() + datetime.timedelta(minutes=duration)
-    
     #
     # TODO 1 of 1:
     #
@@ -224,3 +318,94 @@ def lambda_handler(event, context):
     print(str(err))
 
     return api_utils.error(400, str(err))
+
+
+def _policy(userid, method_arn):
+  #
+  # allow every method and path of this API stage, so
+  # API Gateway can reuse a cached result across routes:
+  #
+  arn, api_path = method_arn.split("/", 1)
+  stage = api_path.split("/", 1)[0]
+
+  return {
+    "principalId": str(userid),
+    "policyDocument": {
+      "Version": "2012-10-17",
+      "Statement": [{
+        "Action": "execute-api:Invoke",
+        "Effect": "Allow",
+        "Resource": arn + "/" + stage + "/*"
+      }]
+    },
+    "context": {"userid": userid}
+  }
+
+
+def _request_token(event):
+  #
+  # TOKEN authorizers get the identity source directly;
+  # REQUEST authorizers get the headers and path:
+  #
+  if event.get("authorizationToken"):
+    return event["authorizationToken"]
+
+  headers = event.get("headers") or {}
+
+  for name in ("Authentication", "Authorization", "authentication", "authorization"):
+    if headers.get(name):
+      return headers[name]
+
+  return (event.get("pathParameters") or {}).get("token")
+
+
+def _dbConn():
+  config = settings.get('benfordapp-config.ini')
+
+  return db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
+
+
+def authorizer_handler(event, context):
+  print("**STARTING**")
+  print("**lambda: proj04_auth authorizer**")
+
+  token = _request_token(event)
+
+  #
+  # raising "Unauthorized" makes API Gateway respond 401:
+  #
+  try:
+    auth_utils.check_token(token)
+  except auth_utils.AuthError as err:
+    print("**Token is not valid, denying...**", str(err))
+    raise Exception("Unauthorized")
+
+  key = auth_utils.token_key(token)
+  cached = authorizer_cache.get(key)
+
+  if cached is not None and datetime.datetime.utcnow() < cached[1]:
+    #
+    # logout elsewhere must still take effect; the revoked
+    # set is itself cached, so a hit usually needs no
+    # connection at all:
+    #
+    if auth_utils.is_revoked(_dbConn, token):
+      print("**Token was revoked, denying...**")
+      raise Exception("Unauthorized")
+
+    print("**authorizer cache hit**")
+    return _policy(cached[0], event["methodArn"])
+
+  dbConn = _dbConn()
+
+  try:
+    (userid, expiration_utc) = auth_utils.validate_token(dbConn, token)
+  except auth_utils.AuthError as err:
+    print("**Token is not valid, denying...**", str(err))
+    raise Exception("Unauthorized")
+
+  authorizer_cache.put(key, (userid, expiration_utc))
+
+  print("**Token is valid, allowing userid", userid, "**")
+
+  return _policy(userid, event["methodArn"])
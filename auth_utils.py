@@ -0,0 +1,319 @@
+#
+# Token validation for the MusicApp lambda functions.
+#
+# Handlers validate the caller's token directly against
+# their already-open database connection, instead of making
+# an HTTP call to the POST /auth web service. Signed tokens
+# (see session_tokens) are verified without any database
+# read; the tokens table is then only consulted, on an
+# interval, for the set of revoked tokens.
+#
+# Rejected tokens are remembered, by hash, in a short-lived
+# negative cache, so a client replaying a stale token is
+# turned away by check_token() before the handler opens a
+# database connection.
+#
+
+import os
+import time
+import hashlib
+import datetime
+import datatier
+import ttl_cache
+import session_tokens
+
+
+#
+# how often, in seconds, the revoked token set is re-read
+# from the tokens table:
+#
+REVOCATION_REFRESH = int(os.getenv("REVOCATION_REFRESH", "60"))
+
+_revoked = set()
+_revoked_loaded_at = None
+
+#
+# token hash => "invalid token" / "expired token", and
+# token hash => number of failed attempts seen recently:
+#
+NEGATIVE_CACHE_SIZE = int(os.getenv("NEGATIVE_CACHE_SIZE", "4096"))
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "60"))
+FAILURE_WARN_EVERY = int(os.getenv("FAILURE_WARN_EVERY", "10"))
+
+_rejected = ttl_cache.get_cache("rejected_tokens", NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL)
+_failures = ttl_cache.get_cache("token_failures", NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL * 10)
+
+#
+# token queries, also EXPLAINed by check_query_plans.py:
+#
+REVOKED_TOKENS_SQL = "SELECT token FROM tokens WHERE revoked = 1 AND expiration_utc > UTC_TIMESTAMP();"
+VALIDATE_TOKEN_SQL = "SELECT userid, expiration_utc, revoked FROM tokens WHERE token = %s;"
+
+
+class AuthError(Exception):
+  """
+  Raised when a token is missing, unknown, revoked or expired.
+  """
+  pass
+
+
+def token_key(token):
+  """
+  Returns the hash a token is cached under, so raw tokens
+  are never kept in memory
+  """
+  return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _count_failure(key):
+  failures = _failures.get(key, 0) + 1
+  _failures.put(key, failures)
+
+  if failures % FAILURE_WARN_EVERY == 0:
+    print("**WARNING: token", key[:12], "rejected", failures, "times**")
+
+
+def _reject(token, reason):
+  key = token_key(token)
+
+  _rejected.put(key, reason)
+  _count_failure(key)
+
+  raise AuthError(reason)
+
+
+def _revoked_due():
+  return _revoked_loaded_at is None or time.monotonic() - _revoked_loaded_at >= REVOCATION_REFRESH
+
+
+def _revoked_tokens(dbConn):
+  global _revoked, _revoked_loaded_at
+
+  if _revoked_due():
+    rows = datatier.retrieve_all_rows(dbConn, REVOKED_TOKENS_SQL)
+
+    _revoked = {row[0] for row in rows}
+    _revoked_loaded_at = time.monotonic()
+
+  return _revoked
+
+
+def is_revoked(connect, token):
+  """
+  Returns True if the token is in the revoked token set,
+  which is re-read from the tokens table at most every
+  REVOCATION_REFRESH seconds. Covers stored and signed
+  tokens alike, so callers holding a cached validation
+  can recheck it without a per-request query.
+
+  Parameters
+  ----------
+  connect: function returning an open connection to the
+           database; only called when the set is re-read
+  token: authentication token passed by the caller
+
+  Returns
+  -------
+  True or False
+  """
+  if _revoked_due():
+    _revoked_tokens(connect())
+
+  return token in _revoked
+
+
+def check_token(token):
+  """
+  Cheap pre-check, with no database access: rejects a missing
+  token, a token that was recently rejected, and a signed
+  token whose signature or expiration is bad. Handlers call
+  this before opening their database connection.
+
+  Parameters
+  ----------
+  token: authentication token passed by the caller
+
+  Returns
+  -------
+  nothing; raises AuthError("invalid token") or
+  AuthError("expired token")
+  """
+  if not token:
+    raise AuthError("invalid token")
+
+  key = token_key(token)
+  reason = _rejected.get(key)
+
+  if reason is not None:
+    _count_failure(key)
+    raise AuthError(reason)
+
+  if session_tokens.is_signed(token):
+    verified = session_tokens.verify(token)
+
+    if verified is None:
+      _reject(token, "invalid token")
+
+    if datetime.datetime.utcnow() >= verified[1]:
+      _reject(token, "expired token")
+
+
+def authorized_userid(event):
+  """
+  Returns the userid that the API Gateway authorizer (see
+  auth.authorizer_handler) attached to the request, or None
+  if the request did not come through the authorizer.
+
+  Parameters
+  ----------
+  event: the lambda event
+
+  Returns
+  -------
+  userid as an int, or None
+  """
+  authorizer = (event.get("requestContext") or {}).get("authorizer") or {}
+
+  userid = authorizer.get("userid")
+
+  if userid is None:
+    return None
+
+  return int(userid)
+
+
+def validate_token(dbConn, token):
+  """
+  Checks that a token is genuine, not revoked and has not
+  expired. Recently rejected tokens fail from the negative
+  cache; signed tokens are verified in-process; other
+  tokens are looked up with a single query against the
+  tokens table.
+
+  Parameters
+  ----------
+  dbConn: open connection to the database
+  token: authentication token passed by the caller
+
+  Returns
+  -------
+  (userid, expiration_utc) of the token's user; raises
+  AuthError("invalid token") or AuthError("expired token")
+  """
+  check_token(token)
+
+  if session_tokens.is_signed(token):
+    (userid, expiration_utc) = session_tokens.verify(token)
+
+    if token in _revoked_tokens(dbConn):
+      _reject(token, "invalid token")
+
+    return (userid, expiration_utc)
+
+  row = datatier.retrieve_one_row(dbConn, VALIDATE_TOKEN_SQL, [token])
+
+  if row == () or row[2]:
+    _reject(token, "invalid token")
+
+  userid = row[0]
+  expiration_utc = row[1]
+
+  utc_now = datetime.datetime.utcnow()
+
+  if utc_now >= expiration_utc:
+    _reject(token, "expired token")
+
+  return (userid, expiration_utc)
+
+
+def revoke_token(dbConn, token):
+  """
+  Revokes a valid token. Stored tokens are flagged in place;
+  signed tokens are added to the tokens table as revoked.
+
+  Parameters
+  ----------
+  dbConn: open connection to the database
+  token: authentication token to revoke
+
+  Returns
+  -------
+  nothing; raises AuthError if the token is not valid
+  """
+  (userid, expiration_utc) = validate_token(dbConn, token)
+
+  if not session_tokens.is_signed(token):
+    sql = "UPDATE tokens SET revoked = 1 WHERE token = %s;"
+
+    datatier.perform_action(dbConn, sql, [token])
+  else:
+    #
+    # signed tokens have no row until they are revoked. The
+    # upsert only needs the unique index of migration 005 to
+    # avoid a second row; without it a repeat revocation
+    # adds a duplicate revoked row, which is harmless:
+    #
+    sql = """
+          INSERT INTO tokens (token, userid, expiration_utc, revoked)
+          VALUES (%s, %s, %s, 1)
+          ON DUPLICATE KEY UPDATE revoked = 1
+          """
+
+    datatier.perform_action(dbConn, sql, [token, userid, expiration_utc])
+
+    _revoked.add(token)
+
+  _rejected.put(token_key(token), "invalid token")
+
+
+def refresh_token(dbConn, token, expiration_utc):
+  """
+  Extends a still-valid token to a new expiration, without
+  re-checking the user's password. A stored token is
+  extended in place with a single UPDATE; a signed token is
+  re-issued with the new expiration, with no write at all.
+
+  Parameters
+  ----------
+  dbConn: open connection to the database
+  token: authentication token to refresh
+  expiration_utc: new expiration, naive UTC datetime
+
+  Returns
+  -------
+  the token to use from now on (unchanged for stored
+  tokens); raises AuthError if the token is not valid, or
+  if it is signed but signed tokens are no longer issued
+  """
+  check_token(token)
+
+  if session_tokens.is_signed(token):
+    (userid, old_expiration_utc) = session_tokens.verify(token)
+
+    if token in _revoked_tokens(dbConn):
+      _reject(token, "invalid token")
+
+    #
+    # with no active signing key the token cannot be
+    # re-issued; the user must log in to get a stored one:
+    #
+    if not session_tokens.enabled():
+      raise AuthError("signed tokens are disabled, log in again")
+
+    return session_tokens.issue(userid, expiration_utc)
+
+  sql = """
+        UPDATE tokens SET expiration_utc = %s
+        WHERE token = %s AND revoked = 0 AND expiration_utc > UTC_TIMESTAMP()
+        """
+
+  modified = datatier.perform_action(dbConn, sql, [expiration_utc, token])
+
+  #
+  # nothing changed: either the token is not valid, or it
+  # was just refreshed to the same second; tell which:
+  #
+  if modified != 1:
+    validate_token(dbConn, token)
+
+  return token
@@ -0,0 +1,160 @@
+#
+# Classifies the existing rows of ratings and folder_music
+# whose kind is still NULL as "track" or "album", so the
+# read lambdas can route them straight to the right
+# Spotify endpoint.
+#
+# Ids are classified in bulk: the music_metadata table is
+# consulted first, then the remaining ids go through the
+# Spotify multi-id endpoints, 50 tracks / 20 albums per call.
+# Ids Spotify knows as neither are left NULL.
+#
+# The Spotify token can be passed in the event as
+# { "spotify_token": "..." }; otherwise a client-credentials
+# token is requested.
+#
+
+import json
+import boto3
+import os
+import datatier
+import settings
+import db_utils
+import spotify_utils
+import music_metadata
+import spotify_api_connect
+
+
+#
+# number of distinct musicids classified per round:
+#
+BATCH_SIZE = 500
+
+
+def backfill_table(dbConn, table, headers, ttl):
+  """
+  Fills in the kind column of one table
+
+  Parameters
+  ----------
+  dbConn: open connection to the MusicApp database
+  table: "ratings" or "folder_music"
+  headers: request headers from spotify_utils.auth_headers()
+  ttl: music_metadata TTL, in seconds
+
+  Returns
+  -------
+  number of rows updated
+  """
+  updated = 0
+  last_musicid = ""
+
+  while True:
+    #
+    # walk the unclassified ids in musicid order, so ids
+    # Spotify cannot classify are not revisited:
+    #
+    sql = f"""
+          SELECT DISTINCT musicid FROM {table}
+          WHERE kind IS NULL AND musicid > %s
+          ORDER BY musicid
+          LIMIT %s
+          """
+
+    rows = datatier.retrieve_all_rows(dbConn, sql, [last_musicid, BATCH_SIZE])
+
+    if not rows:
+      break
+
+    musicids = [row[0] for row in rows]
+    last_musicid = musicids[-1]
+
+    metadata = music_metadata.hydrate(dbConn, musicids, headers, ttl)
+
+    for kind in ("track", "album"):
+      ids = [musicid for musicid in musicids
+             if musicid in metadata and metadata[musicid]["kind"] == kind]
+
+      if not ids:
+        continue
+
+      placeholders = ", ".join(["%s"] * len(ids))
+
+      sql = f"""
+            UPDATE {table} SET kind = %s
+            WHERE kind IS NULL AND musicid IN ({placeholders})
+            """
+
+      updated += datatier.perform_action(dbConn, sql, [kind] + ids)
+
+    print(f"{table}: classified up to {last_musicid}, {updated} rows updated")
+
+  return updated
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    spotify_utils.set_deadline(context)
+    print("**lambda: backfill_music_kind**")
+
+    #
+    # configuration, read once per container (see
+    # settings.py):
+    #
+    config = settings.get()
+
+    metadata_ttl = config.metadata_ttl
+
+    #
+    # Spotify token from the event, or mint one:
+    #
+    spotify_token = (event or {}).get("spotify_token")
+
+    if not spotify_token:
+      spotify_token = spotify_api_connect.get_access_token()
+
+    if not spotify_token:
+      raise Exception("unable to obtain a Spotify access token")
+
+    headers = spotify_utils.auth_headers(spotify_token)
+
+    #
+    # open connection to the database:
+    #
+    print("**Opening connection**")
+
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
+
+    result = {}
+    for table in ("ratings", "folder_music"):
+      result[table] = backfill_table(dbConn, table, headers, metadata_ttl)
+
+    print("**DONE, returning counts**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps(result)
+    }
+
+  except spotify_utils.SpotifyError as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return spotify_utils.error_response(err.status_code)
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
+
+
+#
+# allow running from the command line as well:
+#
+if __name__ == "__main__":
+  print(lambda_handler({}, None))
@@ -0,0 +1,103 @@
+#
+# Picks the bcrypt cost for password hashes (see passwords.py)
+# that fits a target login latency on the memory size this
+# lambda is configured with. Lambda CPU scales with memory,
+# so run it at the same memory size as the auth lambda, and
+# again at each memory tier being considered. The event is
+# optional:
+#
+# { "target_ms": 250, "min_cost": 8, "max_cost": 14, "samples": 3 }
+#
+# For each cost it reports the median time to hash and to
+# check a password (a login does one check), and recommends
+# the highest cost whose check stays within target_ms. Set
+# PASSWORD_HASH_COST on the auth and add_user lambdas to the
+# recommended value; existing users are rehashed the next
+# time they log in.
+#
+
+import json
+import os
+import time
+import statistics
+import passwords
+
+
+def _median_ms(fn, samples):
+  timings = []
+
+  for _ in range(samples):
+    start = time.perf_counter()
+    fn()
+    timings.append((time.perf_counter() - start) * 1000)
+
+  return statistics.median(timings)
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: calibrate_password_cost**")
+
+    event = event or {}
+
+    target_ms = float(event.get("target_ms", os.getenv("LOGIN_TARGET_MS", "250")))
+    min_cost = int(event.get("min_cost", 8))
+    max_cost = int(event.get("max_cost", 14))
+    samples = int(event.get("samples", 3))
+
+    memory_mb = os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "unknown")
+
+    print("memory_mb:", memory_mb)
+    print("target_ms:", target_ms)
+
+    pwd = "calibration-password"
+
+    timings = {}
+    recommended = min_cost
+
+    for cost in range(min_cost, max_cost + 1):
+      pwdhash = passwords.hash_password(pwd, cost)
+
+      hash_ms = _median_ms(lambda: passwords.hash_password(pwd, cost), samples)
+      check_ms = _median_ms(lambda: passwords.check_password(pwd, pwdhash), samples)
+
+      timings[cost] = {"hash_ms": round(hash_ms, 1), "check_ms": round(check_ms, 1)}
+
+      print("cost", cost, "hash_ms", round(hash_ms, 1), "check_ms", round(check_ms, 1))
+
+      if check_ms <= target_ms:
+        recommended = cost
+      else:
+        #
+        # each step doubles the work, so higher costs
+        # will only be slower:
+        #
+        break
+
+    print("**DONE, recommended cost:", recommended, "**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps({"memory_mb": memory_mb,
+                          "target_ms": target_ms,
+                          "current_cost": passwords.HASH_COST,
+                          "recommended_cost": recommended,
+                          "timings": timings})
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
+
+
+#
+# allow running from the command line as well:
+#
+if __name__ == "__main__":
+  print(lambda_handler({}, None))
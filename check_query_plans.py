@@ -0,0 +1,161 @@
+#
+# Runs EXPLAIN on the hot queries of the MusicApp lambdas
+# and reports any that do a full table scan or a filesort,
+# i.e. any that an index in migrations/ should be serving.
+# Run it after applying migrations, against a database with
+# realistic data: on nearly empty tables MySQL may choose a
+# scan even when an index exists.
+#
+# Runs as a lambda or from the command line; from the
+# command line the exit status is 1 if any query fails the
+# check, so it can gate a deploy.
+#
+
+import json
+import sys
+import settings
+import db_utils
+
+#
+# the SQL is imported from the modules that run it, so the
+# check cannot drift from what the handlers actually send:
+#
+import auth
+import auth_utils
+import sweep_tokens
+import add_user
+import get_users
+import get_ratings
+import get_folders
+import user_stats_agg
+import music_metadata
+
+
+TOKEN = "00000000-0000-0000-0000-000000000000"
+
+MUSICIDS = ["0000000000000000000000", "1111111111111111111111"]
+
+#
+# (name, SQL, sample parameters):
+#
+HOT_QUERIES = [
+  ("auth_utils.validate_token", auth_utils.VALIDATE_TOKEN_SQL, [TOKEN]),
+
+  ("auth_utils revoked tokens", auth_utils.REVOKED_TOKENS_SQL, []),
+
+  ("sweep_tokens", sweep_tokens.SWEEP_SQL, [1000]),
+
+  ("auth.py login", auth.LOGIN_SQL, ["nobody"]),
+
+  ("add_user email check", add_user.EXISTING_USER_SQL, ["nobody@example.com"]),
+
+  ("get_users page", get_users.PAGE_SQL, [0, 101]),
+
+  ("get_ratings, token join", get_ratings.TOKEN_JOIN_SQL, [TOKEN, 0, 101]),
+
+  ("get_ratings, by userid", get_ratings.BY_USERID_SQL, [1, 0, 101]),
+
+  ("get_folders, token join", get_folders.TOKEN_JOIN_SQL, [TOKEN]),
+
+  ("get_folders, by userid", get_folders.BY_USERID_SQL, [1]),
+
+  ("user_stats_agg.read aggregates", user_stats_agg.AGGREGATES_SQL, [1]),
+
+  ("user_stats_agg.read top-k", user_stats_agg.TOP_K_SQL,
+   [value for category in user_stats_agg.CATEGORIES for value in (1, category, user_stats_agg.TOP_K)]),
+
+  ("user_stats_agg.rebuild ratings", user_stats_agg.RATINGS_SQL, [1]),
+
+  ("music_metadata.lookup",
+   music_metadata.LOOKUP_SQL.format(placeholders=", ".join(["%s"] * len(MUSICIDS))),
+   MUSICIDS + [settings.DEFAULT_METADATA_TTL]),
+]
+
+
+def explain(dbConn, sql, parameters):
+  """
+  Runs EXPLAIN on a statement
+
+  Returns
+  -------
+  list of dictionaries, one per row of the plan
+  """
+  dbCursor = dbConn.cursor()
+
+  try:
+    dbCursor.execute("EXPLAIN " + sql, parameters)
+
+    columns = [column[0] for column in dbCursor.description]
+
+    return [dict(zip(columns, row)) for row in dbCursor.fetchall()]
+  finally:
+    dbCursor.close()
+
+
+def problems(plan):
+  """
+  Returns the full scans and filesorts in an EXPLAIN plan,
+  as a list of messages
+  """
+  found = []
+
+  for step in plan:
+    table = step.get("table")
+    extra = step.get("Extra") or ""
+
+    if step.get("type") == "ALL":
+      found.append(f"full scan of {table}")
+
+    if "Using filesort" in extra:
+      found.append(f"filesort on {table}")
+
+  return found
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: check_query_plans**")
+
+    config = settings.get()
+
+    print("**Opening connection**")
+
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
+
+    failures = {}
+
+    for (name, sql, parameters) in HOT_QUERIES:
+      plan = explain(dbConn, sql, parameters)
+      found = problems(plan)
+
+      if found:
+        failures[name] = found
+        print("FAIL", name, "-", "; ".join(found))
+      else:
+        print("ok  ", name, "-", ", ".join(str(step.get("key")) for step in plan))
+
+    print("**DONE,", len(failures), "of", len(HOT_QUERIES), "queries failed**")
+
+    return {
+      'statusCode': 200 if not failures else 500,
+      'body': json.dumps({"checked": len(HOT_QUERIES), "failures": failures})
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
+
+
+#
+# allow running from the command line as well:
+#
+if __name__ == "__main__":
+  result = lambda_handler({}, None)
+  print(result)
+  sys.exit(0 if result['statusCode'] == 200 else 1)
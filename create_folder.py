@@ -7,9 +7,11 @@ import json
 import boto3
 import os
 import datatier
-import requests
+import settings
+import db_utils
+import auth_utils
+import api_utils
 
-from configparser import ConfigParser
 
 def lambda_handler(event, context):
   try:
@@ -17,13 +19,10 @@ def lambda_handler(event, context):
     print("**lambda: proj03_users**")
     
     #
-    # setup AWS based on config file:
+    # configuration, read once per container (see
+    # settings.py):
     #
-    config_file = 'musicapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
+    config = settings.get()
     
     #
     # configure for S3 access:
@@ -36,14 +35,6 @@ def lambda_handler(event, context):
     #s3 = boto3.resource('s3')
     #bucket = s3.Bucket(bucketname)
     
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
 
 
     #
@@ -62,46 +53,50 @@ def lambda_handler(event, context):
       
     body = json.loads(event["body"]) # parse the json
     
-    if "token" not in body:
+    if "token" not in body and auth_utils.authorized_userid(event) is None:
       raise Exception("event has a body but no token")
       
 
     if "folder_name" not in body:
       raise Exception("event has a body but no folder name")
       
-    token = body["token"]
+    token = body.get("token")
     folder_name = body["folder_name"]
+    
     #
-    # is the token valid? Ask the authentication service...
+    # requests that came through the authorizer already
+    # carry the userid; otherwise turn away recently
+    # rejected tokens before doing any database work:
     #
-    auth_url = configur.get('auth', 'webservice')
-    data = {"token": token}
+    userid = auth_utils.authorized_userid(event)
     
-    api = '/auth'
-    url = auth_url + api
+    if userid is None:
+      try:
+        auth_utils.check_token(token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return api_utils.error(401, msg)
     
-    response = requests.post(url, json=data)
-    
-    if response.status_code != 200:
-      msg = "authentication failure"
-      print("**ERROR:", msg)
-      return api_utils.error(401, msg)
-    
-
     #
     # open connection to the database:
     #
     print("**Opening connection**")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
     
     
     #
-    # retrieve userid from tokens
+    # is the token valid? Check it against the tokens table,
+    # which also tells us who the user is:
     #
-    user_sql = "SELECT userid FROM tokens WHERE token = %s"
-    user_info = datatier.retrieve_one_row(dbConn, user_sql, token)
-    userid = user_info[0]
+    if userid is None:
+      try:
+        (userid, expiration_utc) = auth_utils.validate_token(dbConn, token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return api_utils.error(401, msg)
     
     
     #
@@ -7,24 +7,38 @@ import json
 import boto3
 import os
 import datatier
-import requests
+import settings
+import db_utils
+import auth_utils
 import api_utils
+import spotify_utils
+import music_metadata
+import user_stats_agg
+
+
+#
+# most ratings accepted in one bulk request:
+#
+MAX_BATCH_SIZE = int(os.getenv("MAX_RATING_BATCH_SIZE", "500"))
+
+#
+# times the insert transaction is run when it hits a
+# deadlock or lock wait timeout:
+#
+TRANSACTION_ATTEMPTS = 3
 
-from configparser import ConfigParser
 
 def lambda_handler(event, context):
   try:
     print("**STARTING**")
+    spotify_utils.set_deadline(context)
     print("**create_rating**")
     
     #
-    # setup AWS based on config file:
+    # configuration, read once per container (see
+    # settings.py):
     #
-    config_file = 'musicapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
+    config = settings.get()
     
     #
     # configure for S3 access:
@@ -37,14 +51,6 @@ def lambda_handler(event, context):
     #s3 = boto3.resource('s3')
     #bucket = s3.Bucket(bucketname)
     
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
 
     #
     # get authentication token from request headers:
@@ -56,28 +62,54 @@ def lambda_handler(event, context):
     token = path_parameters.get("token")
     
     #
-    # is the token valid? Ask the authentication service...
+    # requests that came through the authorizer already
+    # carry the userid; otherwise turn away recently
+    # rejected tokens before doing any database work:
+    #
+    userid = auth_utils.authorized_userid(event)
+    
+    if userid is None:
+      try:
+        auth_utils.check_token(token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return api_utils.error(401, msg)
+    
+    #
+    # open connection to the database:
     #
-    auth_url = configur.get('auth', 'webservice')
-    data = {"token": token}
+    print("**Opening connection**")
     
-    api = '/auth'
-    url = auth_url + api
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
     
-    response = requests.post(url, json=data)
     
-    if response.status_code != 200:
-      msg = "authentication failure"
-      print("**ERROR:", msg)
-      return api_utils.error(401, msg)
+    #
+    # is the token valid? Check it against the tokens table,
+    # which also tells us who the user is:
+    #
+    if userid is None:
+      try:
+        (userid, expiration_utc) = auth_utils.validate_token(dbConn, token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return api_utils.error(401, msg)
+    
     
-      
-
     #
-    # the user has sent us 3 parameters:
-    #  1. musicid
+    # the user has sent us up to 4 parameters:
+    #  1. musicid (a Spotify id, URI or URL)
     #  2. num_stars
     #  3. comment
+    #  4. kind ("track" or "album", optional if the
+    #     musicid is a Spotify URI or URL)
+    #  5. spotify_token (optional, lets us look up the
+    #     music to keep the user's stats up to date)
+    #
+    # or, to add many ratings at once, a "ratings" list of
+    # {musicid, num_stars, comment, kind} items (at most
+    # MAX_BATCH_SIZE) plus the optional spotify_token.
     #
     # The parameters are coming through web server 
     # (or API Gateway) in the body of the request
@@ -90,56 +122,167 @@ def lambda_handler(event, context):
       
     body = json.loads(event["body"]) # parse the json
     
-    if "musicid" not in body:
-      raise Exception("event has a body but no musicid")
-    
-    # num stars not neccessary?
-    # bc could be 0 stars ??
-    num_stars = "0"
-    comment = ""
-    # comment is not necessary
-    musicid = body["musicid"]
-    if "num_stars" in body:
-      num_stars = body["num_stars"]
+    bulk = "ratings" in body
+    
+    if bulk:
+      items = body["ratings"]
+      
+      if not isinstance(items, list) or len(items) == 0:
+        raise Exception("ratings must be a non-empty list")
+      
+      if len(items) > MAX_BATCH_SIZE:
+        return api_utils.error(400, f"at most {MAX_BATCH_SIZE} ratings per request")
+    else:
+      if "musicid" not in body:
+        raise Exception("event has a body but no musicid")
       
-    if "comment" in body:
-      comment = body["comment"]
+      items = [body]
     
-
     #
-    # open connection to the database:
+    # check each item; in a batch, a bad item is reported
+    # back and the rest are still added:
     #
-    print("**Opening connection**")
+    ratings = []  # (musicid, num_stars, comment, kind)
+    results = []
+    
+    for (index, item) in enumerate(items):
+      try:
+        if "musicid" not in item:
+          raise Exception("item has no musicid")
+        
+        # num stars not neccessary?
+        # bc could be 0 stars ??
+        num_stars = "0"
+        comment = ""
+        # comment is not necessary
+        musicid, kind = spotify_utils.parse_music_id(item["musicid"], item.get("kind"))
+        
+        if "num_stars" in item:
+          num_stars = item["num_stars"]
+          
+        if "comment" in item:
+          comment = item["comment"]
+        
+        int(num_stars)
+      except Exception as err:
+        if not bulk:
+          raise
+        
+        results.append({"index": index, "status": "error", "message": str(err)})
+        continue
+      
+      ratings.append((musicid, num_stars, comment, kind))
+      results.append({"index": index, "musicid": musicid, "status": "ok"})
+      
+    spotify_token = body.get("spotify_token")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
     
     #
-    # retrieve userid from tokens
+    # look up the music so the ratings can be added to the
+    # user's stats aggregates; without a Spotify token we
+    # can only use metadata that is already stored:
     #
-    user_sql = "SELECT userid FROM tokens WHERE token = %s"
-    user_info = datatier.retrieve_one_row(dbConn, user_sql, token)
-    userid = user_info[0]
+    if spotify_token:
+      headers = spotify_utils.auth_headers(spotify_token)
+    else:
+      headers = None
+    
+    metadata_ttl = config.metadata_ttl
+    
+    musicids = [musicid for (musicid, num_stars, comment, kind) in ratings]
+    known_kinds = {musicid: kind for (musicid, num_stars, comment, kind) in ratings if kind}
+    
+    complete = False
+    
+    if ratings:
+      try:
+        (metadata, album_metadata, artist_metadata) = \
+          user_stats_agg.metadata_for(dbConn, musicids, known_kinds, headers, metadata_ttl)
+        
+        (weights, complete) = \
+          user_stats_agg.weights_for([(musicid, num_stars) for (musicid, num_stars, comment, kind) in ratings],
+                                     metadata, album_metadata, artist_metadata)
+      except spotify_utils.SpotifyError as err:
+        print("**WARNING: Spotify lookup failed:", str(err))
+        complete = False
     
     
     #
-    # now insert rating:
+    # now insert ratings:
     #
     print("**Retrieving data**")
 
     #
-    # insert ratings into authenticated users userid in ratings table
+    # insert ratings into authenticated users userid in ratings
+    # table, all in one statement, and update their stats in
+    # the same transaction:
     #
-    sql = """
-          INSERT INTO ratings (userid, musicid, num_stars, comment)
-          VALUES (%s, %s, %s, %s)
-          """
-    rating_info = [userid, musicid, num_stars, comment]
-
-    modified = datatier.perform_action(dbConn, sql, rating_info)
-
-    if modified != 1:
-      print("**INTERNAL ERROR: insert into database failed...**")
-      return api_utils.error(400, "INTERNAL ERROR: insert failed to modify database")
+    if ratings:
+      placeholders = ", ".join(["(%s, %s, %s, %s, %s)"] * len(ratings))
+      
+      sql = f"""
+            INSERT INTO ratings (userid, musicid, num_stars, comment, kind)
+            VALUES {placeholders}
+            """
+      
+      rating_info = []
+      for (musicid, num_stars, comment, kind) in ratings:
+        rating_info += [userid, musicid, num_stars, comment, kind]
+      
+      star_sum = sum(int(num_stars) for (musicid, num_stars, comment, kind) in ratings)
+      
+      for attempt in range(1, TRANSACTION_ATTEMPTS + 1):
+        dbCursor = dbConn.cursor()
+        try:
+          #
+          # lock the user's aggregates row before inserting, in
+          # the same order as user_stats_agg.rebuild:
+          #
+          user_stats_agg.lock(dbCursor, userid)
+          
+          dbCursor.execute(sql, rating_info)
+          modified = dbCursor.rowcount
+          
+          if modified != len(ratings):
+            dbConn.rollback()
+            dbCursor.close()
+            print("**INTERNAL ERROR: insert into database failed...**")
+            return api_utils.error(400, "INTERNAL ERROR: insert failed to modify database")
+          
+          #
+          # if the counters cannot be updated, undo just that
+          # and keep the ratings; the next read rebuilds the
+          # aggregates. A deadlock has already rolled back the
+          # whole transaction, so it goes to the retry below:
+          #
+          counted = complete
+          
+          if counted:
+            dbCursor.execute("SAVEPOINT user_stats")
+            try:
+              user_stats_agg.increment(dbCursor, userid, star_sum, len(ratings), weights)
+            except Exception as err:
+              if db_utils.is_retryable(err):
+                raise
+              print("**WARNING: user stats increment failed, marking stale:", str(err))
+              dbCursor.execute("ROLLBACK TO SAVEPOINT user_stats")
+              counted = False
+          
+          if not counted:
+            user_stats_agg.mark_stale(dbCursor, userid)
+          
+          dbConn.commit()
+          dbCursor.close()
+          break
+        except Exception as err:
+          dbConn.rollback()
+          dbCursor.close()
+          if attempt < TRANSACTION_ATTEMPTS and db_utils.is_retryable(err):
+            print("**WARNING: retrying insert after:", str(err))
+            continue
+          raise
+    
+    print("inserted", len(ratings), "of", len(items), "ratings")
     
     #
     # respond in an HTTP-like way, i.e. with a status
@@ -147,6 +290,13 @@ def lambda_handler(event, context):
     #
     print("**DONE, returning**")
     
+    if bulk:
+      return {
+        'statusCode': 200,
+        'body': json.dumps({"message": f"{len(ratings)} of {len(items)} ratings added",
+                            "results": results})
+      }
+    
     return {
       'statusCode': 200,
       'body': json.dumps({"message": "Rating added successfully"})
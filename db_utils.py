@@ -0,0 +1,254 @@
+#
+# Database connection reuse for the MusicApp lambda functions.
+#
+# datatier.get_dbConn opens a new connection (TCP + TLS +
+# MySQL handshake) on every call. Handlers call
+# db_utils.get_dbConn instead, which keeps connections at
+# module scope so warm invocations of the same container
+# reuse them. A cached connection is pinged before use and
+# reopened if RDS has dropped it.
+#
+# Lambda runs one invocation at a time per container, so a
+# container needs only one connection per database; at most
+# MAX_DB_CONNECTIONS are kept, least recently used closed
+# first. Total connections to RDS are then bounded by the
+# functions' concurrency.
+#
+# For large tables there is also iter_rows, which streams a
+# result through an unbuffered server-side cursor, and
+# retrieve_page, which reads one keyset-paginated page at a
+# time; either keeps memory flat however big the table is.
+#
+
+import os
+import json
+import base64
+import threading
+import datatier
+import pymysql.cursors
+
+from collections import OrderedDict
+
+
+MAX_DB_CONNECTIONS = int(os.getenv("MAX_DB_CONNECTIONS", "1"))
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+#
+# MySQL lock wait timeout and deadlock: the transaction was
+# (or should be) rolled back and can be run again as a whole
+#
+RETRYABLE_ERRORS = (1205, 1213)
+
+_connections = OrderedDict()  # (endpoint, port, user, dbname) => connection
+_lock = threading.Lock()
+
+#
+# counters over the container's lifetime:
+#
+stats = {"opened": 0, "reused": 0, "reconnected": 0}
+
+
+def _close(dbConn):
+  try:
+    dbConn.close()
+  except Exception:
+    pass
+
+
+def _usable(dbConn):
+  try:
+    dbConn.ping(reconnect=False)
+    #
+    # end whatever transaction the previous invocation left
+    # open, so this one doesn't read from an old snapshot:
+    #
+    dbConn.rollback()
+    return True
+  except Exception as err:
+    print("**cached db connection unusable:", str(err), "**")
+    return False
+
+
+def get_dbConn(endpoint, portnum, username, pwd, dbname):
+  """
+  Returns a connection to the database, reusing the one
+  cached by a previous invocation when it is still alive.
+  Takes the same parameters as datatier.get_dbConn.
+
+  Returns
+  -------
+  open connection to the database; raises on failure
+  """
+  key = (endpoint, portnum, username, dbname)
+
+  with _lock:
+    dbConn = _connections.pop(key, None)
+
+    if dbConn is not None:
+      if _usable(dbConn):
+        stats["reused"] += 1
+      else:
+        _close(dbConn)
+        dbConn = None
+        stats["reconnected"] += 1
+
+    if dbConn is None:
+      dbConn = datatier.get_dbConn(endpoint, portnum, username, pwd, dbname)
+      stats["opened"] += 1
+
+    _connections[key] = dbConn
+
+    while len(_connections) > MAX_DB_CONNECTIONS:
+      (_, oldest) = _connections.popitem(last=False)
+      _close(oldest)
+
+  log_stats()
+
+  return dbConn
+
+
+def reuse_ratio():
+  """
+  Returns the fraction of get_dbConn calls served by a
+  cached connection
+  """
+  total = stats["opened"] + stats["reused"]
+
+  return stats["reused"] / total if total else 0.0
+
+
+def log_stats():
+  """
+  Prints connection counters and the reuse ratio
+  """
+  print(f"**db connections: opened={stats['opened']} reused={stats['reused']} "
+        f"reconnected={stats['reconnected']} reuse_ratio={reuse_ratio():.2f}**")
+
+
+def is_retryable(err):
+  """
+  Returns True if err is a MySQL lock wait timeout or
+  deadlock, after which the caller should roll back and run
+  the whole transaction again
+  """
+  return (isinstance(err, pymysql.err.MySQLError)
+          and len(err.args) > 0 and err.args[0] in RETRYABLE_ERRORS)
+
+
+def iter_rows(dbConn, sql, parameters=None, batch_size=500):
+  """
+  Executes a SELECT and yields its rows one at a time from
+  an unbuffered server-side cursor, fetching batch_size rows
+  from the server at a time. No other query may run on the
+  connection until the iteration finishes.
+
+  Parameters
+  ----------
+  dbConn: open connection to the database
+  sql: SELECT statement
+  parameters: values for the statement's %s placeholders
+
+  Returns
+  -------
+  generator of row tuples
+  """
+  dbCursor = dbConn.cursor(pymysql.cursors.SSCursor)
+
+  try:
+    dbCursor.execute(sql, parameters)
+
+    while True:
+      rows = dbCursor.fetchmany(batch_size)
+
+      if not rows:
+        break
+
+      yield from rows
+  finally:
+    dbCursor.close()
+
+
+def encode_cursor(key):
+  """
+  Returns an opaque page cursor for the given key value
+  """
+  return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+  """
+  Returns the key value inside a page cursor; raises
+  ValueError if the cursor is malformed
+  """
+  try:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()))
+  except Exception:
+    raise ValueError("invalid page cursor")
+
+
+def page_size(limit):
+  """
+  Returns the requested page size, defaulted and clamped to
+  1..MAX_PAGE_SIZE
+  """
+  if limit is None or limit == "":
+    return DEFAULT_PAGE_SIZE
+
+  return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def retrieve_after(dbConn, sql, parameters, after, limit, key_index=0):
+  """
+  Reads one page of a keyset-paginated query. The statement
+  must end with
+
+    <key> > %s ORDER BY <key> LIMIT %s
+
+  on a unique key, whose value is column key_index of each
+  row; those last two placeholders are filled in here.
+
+  Parameters
+  ----------
+  dbConn: open connection to the database
+  sql: SELECT statement, as above
+  parameters: values for the statement's other placeholders
+  after: key value the page starts after
+  limit: page size
+
+  Returns
+  -------
+  (rows, last_key), where last_key is the key of the page's
+  last row, or None if this is the last page
+  """
+  #
+  # one extra row tells us whether there is another page:
+  #
+  rows = datatier.retrieve_all_rows(dbConn, sql, list(parameters or []) + [after, limit + 1])
+
+  if len(rows) <= limit:
+    return (rows, None)
+
+  rows = rows[:limit]
+
+  return (rows, rows[-1][key_index])
+
+
+def retrieve_page(dbConn, sql, parameters, cursor, limit, first_key=0, key_index=0):
+  """
+  Like retrieve_after, but with opaque cursors: pass None
+  for the first page (which starts after first_key), then
+  the cursor returned with the previous page.
+
+  Returns
+  -------
+  (rows, next_cursor), where next_cursor is None on the
+  last page
+  """
+  after = first_key if cursor is None else decode_cursor(cursor)
+
+  (rows, last_key) = retrieve_after(dbConn, sql, parameters, after, limit, key_index)
+
+  return (rows, None if last_key is None else encode_cursor(last_key))
@@ -7,10 +7,25 @@ import json
 import boto3
 import os
 import datatier
-import requests
+import settings
+import db_utils
+import auth_utils
+import session_tokens
 import api_utils
 
-from configparser import ConfigParser
+
+#
+# the user's folders, found by token (classic tokens) or by
+# userid; also EXPLAINed by check_query_plans.py:
+#
+TOKEN_JOIN_SQL = """
+  SELECT folders.* FROM folders
+  JOIN tokens ON tokens.userid = folders.userid
+  WHERE tokens.token = %s AND tokens.revoked = 0
+    AND tokens.expiration_utc > UTC_TIMESTAMP()
+  """
+
+BY_USERID_SQL = "SELECT * FROM folders WHERE userid = %s"
 
 
 def lambda_handler(event, context):
@@ -20,13 +35,10 @@ def lambda_handler(event, context):
     print("**get_folders**")
     
     #
-    # setup AWS based on config file:
+    # configuration, read once per container (see
+    # settings.py):
     #
-    config_file = 'musicapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
+    config = settings.get()
     
     #
     # configure for S3 access:
@@ -39,25 +51,9 @@ def lambda_handler(event, context):
     #s3 = boto3.resource('s3')
     #bucket = s3.Bucket(bucketname)
     
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
 
     
 
-    #
-    # open connection to the database:
-    #
-    print("**Opening connection**")
-    
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
-    
-    
     #
     # get authentication token from request headers:
     #
@@ -73,7 +69,7 @@ def lambda_handler(event, context):
     
     headers = event["headers"]
       
-    if "Authentication" not in headers:
+    if "Authentication" not in headers and auth_utils.authorized_userid(event) is None:
       msg = "no security credentials"
       print("**ERROR:", msg)
       return {
@@ -81,48 +77,67 @@ def lambda_handler(event, context):
         'body': json.dumps(headers)
       }
     
-    token = headers['Authentication']
-    
+    token = headers.get('Authentication')
     
     #
-    # is the token valid? Ask the authentication service...
+    # requests that came through the authorizer already
+    # carry the userid; otherwise turn away recently
+    # rejected tokens before doing any database work:
     #
-    auth_url = configur.get('auth', 'webservice')
-    data = {"token": token}
-    
-    api = '/auth'
-    url = auth_url + api
-    
-    response = requests.post(url, json=data)
-    
-    if response.status_code != 200:
-      msg = "authentication failure"
-      print("**ERROR:", msg)
-      return {
-        'statusCode': 401,
-        'body': json.dumps(msg)
-      }
-    
+    userid = auth_utils.authorized_userid(event)
     
+    if userid is None:
+      try:
+        auth_utils.check_token(token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return {
+          'statusCode': 401,
+          'body': json.dumps(msg)
+        }
     
     #
-    # retrieve userid from tokens
+    # open connection to the database:
     #
-    user_sql = "SELECT userid FROM tokens WHERE token = %s"
-    user_info = datatier.retrieve_one_row(dbConn, user_sql, token)
-    userid = user_info[0]
+    print("**Opening connection**")
+    
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
     
     
     #
-    # now get user's' rating:
+    # get the user's folders. Requests from the authorizer
+    # carry the userid, and signed tokens are verified
+    # in-process below. Classic tokens are checked in the
+    # same query: only an unexpired, unrevoked token
+    # matches any rows. Rows are streamed from the server
+    # rather than buffered twice (see db_utils.iter_rows).
     #
     print("**Retrieving data**")
-
-
-    sql = "SELECT * FROM folders WHERE userid = %s"
-
-    rows = datatier.retrieve_all_rows(dbConn, sql, userid)
     
+    rows = []
+    by_userid = userid is not None or session_tokens.is_signed(token)
+
+    if not by_userid:
+      rows = list(db_utils.iter_rows(dbConn, TOKEN_JOIN_SQL, [token]))
+    
+    #
+    # no rows means either no folders or a bad token; only
+    # now do we need to check which:
+    #
+    if not rows and userid is None:
+      try:
+        (userid, expiration_utc) = auth_utils.validate_token(dbConn, token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return {
+          'statusCode': 401,
+          'body': json.dumps(msg)
+        }
+      
+    if by_userid:
+      rows = list(db_utils.iter_rows(dbConn, BY_USERID_SQL, [userid]))
         
     
     #
@@ -1,21 +1,59 @@
 #
-# Gets all of a user's rating's from
-# MusicApp database.
+# Gets a user's rating's from MusicApp database, one page
+# at a time, in ratingid order. Optional query string
+# parameters:
+#
+#   limit           ratings per page (see db_utils.page_size)
+#   after_ratingid  next_after_ratingid from the previous page
+#
+# Returns { "ratings": {...}, "next_after_ratingid": ... };
+# next_after_ratingid is null on the last page. Only the
+# page's ratings are looked up on Spotify, so the first
+# page costs the same however many ratings the user has.
 #
 
 import json
 import boto3
 import os
 import datatier
-import requests
+import settings
+import db_utils
+import auth_utils
+import session_tokens
 import api_utils
+import spotify_utils
+import music_metadata
+import ttl_cache
+
+
+#
+# one page of the user's ratings, found by token (classic
+# tokens) or by userid; also EXPLAINed by
+# check_query_plans.py:
+#
+TOKEN_JOIN_SQL = """
+  SELECT ratings.ratingid, ratings.userid, ratings.musicid,
+         ratings.num_stars, ratings.comment, ratings.kind
+  FROM ratings
+  JOIN tokens ON tokens.userid = ratings.userid
+  WHERE tokens.token = %s AND tokens.revoked = 0
+    AND tokens.expiration_utc > UTC_TIMESTAMP()
+    AND ratings.ratingid > %s
+  ORDER BY ratings.ratingid
+  LIMIT %s
+  """
 
-from configparser import ConfigParser
+BY_USERID_SQL = """
+  SELECT ratingid, userid, musicid, num_stars, comment, kind
+  FROM ratings WHERE userid = %s AND ratingid > %s
+  ORDER BY ratingid LIMIT %s
+  """
 
 
 def lambda_handler(event, context):
   try:
     print("**STARTING**")
+    spotify_utils.set_deadline(context)
     
     # Extract path parameters from the event
     path_parameters = event.get("pathParameters", {})
@@ -27,14 +65,16 @@ def lambda_handler(event, context):
     
     print("**get_ratings**")
     
+    query_parameters = event.get("queryStringParameters") or {}
+    
+    limit = db_utils.page_size(query_parameters.get("limit"))
+    after_ratingid = int(query_parameters.get("after_ratingid") or 0)
+    
     #
-    # setup AWS based on config file:
+    # configuration, read once per container (see
+    # settings.py):
     #
-    config_file = 'musicapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
+    config = settings.get()
     
     #
     # configure for S3 access:
@@ -47,25 +87,9 @@ def lambda_handler(event, context):
     #s3 = boto3.resource('s3')
     #bucket = s3.Bucket(bucketname)
     
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
 
     
 
-    #
-    # open connection to the database:
-    #
-    print("**Opening connection**")
-    
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
-    
-    
     #
     # get authentication token from request headers:
     #
@@ -81,7 +105,7 @@ def lambda_handler(event, context):
     
     headers = event["headers"]
       
-    if "Authentication" not in headers:
+    if "Authentication" not in headers and auth_utils.authorized_userid(event) is None:
       msg = "no security credentials"
       print("**ERROR:", msg)
       return {
@@ -89,54 +113,84 @@ def lambda_handler(event, context):
         'body': json.dumps(headers)
       }
     
-    token = headers['Authentication']
-    
+    token = headers.get('Authentication')
     
     #
-    # is the token valid? Ask the authentication service...
+    # requests that came through the authorizer already
+    # carry the userid; otherwise turn away recently
+    # rejected tokens before doing any database work:
     #
-    auth_url = configur.get('auth', 'webservice')
-    data = {"token": token}
-    
-    api = '/auth'
-    url = auth_url + api
+    userid = auth_utils.authorized_userid(event)
     
-    response = requests.post(url, json=data)
+    if userid is None:
+      try:
+        auth_utils.check_token(token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return {
+          'statusCode': 401,
+          'body': json.dumps(msg)
+        }
     
-    if response.status_code != 200:
-      msg = "authentication failure"
-      print("**ERROR:", msg)
-      return {
-        'statusCode': 401,
-        'body': json.dumps(msg)
-      }
+    #
+    # open connection to the database:
+    #
+    print("**Opening connection**")
     
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
     
     
     #
-    # retrieve userid from tokens
+    # now get user's' rating. Requests from the authorizer
+    # carry the userid, and signed tokens are verified
+    # in-process below. Classic tokens are checked in the
+    # same query: only an unexpired, unrevoked token
+    # matches any rows.
     #
-    user_sql = "SELECT userid FROM tokens WHERE token = %s"
-    user_info = datatier.retrieve_one_row(dbConn, user_sql, token)
-    userid = user_info[0]
+    print("**Retrieving data**")
     
+    rows = []
+    next_after_ratingid = None
+    by_userid = userid is not None or session_tokens.is_signed(token)
+
+    if not by_userid:
+      (rows, next_after_ratingid) = db_utils.retrieve_after(dbConn, TOKEN_JOIN_SQL, [token], after_ratingid, limit)
+    
+    #
+    # no rows means either no ratings or a bad token; only
+    # now do we need to check which:
+    #
+    if not rows and userid is None:
+      try:
+        (userid, expiration_utc) = auth_utils.validate_token(dbConn, token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return {
+          'statusCode': 401,
+          'body': json.dumps(msg)
+        }
+      
+    if by_userid:
+      (rows, next_after_ratingid) = db_utils.retrieve_after(dbConn, BY_USERID_SQL, [userid], after_ratingid, limit)
     
     #
-    # now get user's' rating:
+    # look up this page's rated ids, reading the shared
+    # metadata table first and only going to Spotify for
+    # the ids that are missing or stale:
     #
-    print("**Retrieving data**")
-
-
-    sql = "SELECT * FROM ratings WHERE userid = %s ORDER BY ratingid"
-
-
-    rows = datatier.retrieve_all_rows(dbConn, sql, userid)
+    headers = spotify_utils.auth_headers(spotify_token)
     
-    # Make the request to Spotify API with the provided token
-    headers = {
-        'Authorization': "Bearer " + spotify_token,
-        'Content-Type': 'application/json'
-    }
+    metadata_ttl = config.metadata_ttl
+    
+    musicids = [row[2] for row in rows]
+    known_kinds = {row[2]: row[5] for row in rows if row[5]}
+    
+    try:
+      metadata = music_metadata.hydrate(dbConn, musicids, headers, metadata_ttl, known_kinds=known_kinds)
+    except spotify_utils.SpotifyError as err:
+      return spotify_utils.error_response(err.status_code)
     
     result = {}
     for row in rows:
@@ -149,54 +203,21 @@ def lambda_handler(event, context):
       num_stars = row[3]
       comment = row[4]
       
-      url = f"https://api.spotify.com/v1/tracks/{trackid}"
-      response = requests.get(url, headers=headers)
-      data = response.json()
-            
-      # Check the status code of the response
-      if response.status_code != 200:
-          ##
-          # maybe an album instead?
-          url = f"https://api.spotify.com/v1/albums/{trackid}"
-          response = requests.get(url, headers=headers)
-          data = response.json()
-          
-          if response.status_code == 200:
-            album_name = data["name"]
-            artists = [artist["name"] for artist in data["artists"]]
-            
-            result[ratingid] = {"userid":userid, "num_stars":num_stars, "comment":comment,
-            "album": album_name, "artists": artists, "trackid": trackid}
-            
-            print(result[ratingid])
-          
-          else:
-            if response.status_code == 401:
-              return {
-                  'statusCode': response.status_code,
-                  'body': json.dumps("error: Spotify API has a bad or expired token")
-              }
-            if response.status_code == 403:
-                return {
-                    'statusCode': response.status_code,
-                    'body': json.dumps("error: Spotify API has bad OAuth request")
-                }
-            return {
-                'statusCode': response.status_code,
-                'body': json.dumps("error: Spotify API error")
-            }
-          
-      # still an error, then no luck .....
+      # neither a track nor an album, no luck .....
+      if trackid not in metadata:
+        print("**WARNING: Spotify has no track or album with id", trackid)
+        continue
+      
+      entry = metadata[trackid]
+      
+      if entry["kind"] == "track":
+        result[ratingid] = {"userid":userid, "num_stars":num_stars, "comment":comment,
+        "track_name":entry["name"], "album": entry["album"], "artists": entry["artist_names"], "trackid": trackid}
       else:
-        trackname = data["name"]
-        album_name = data["album"]["name"] if "album" in data else "None"
-        artists = [artist["name"] for artist in data["artists"]]
-        
         result[ratingid] = {"userid":userid, "num_stars":num_stars, "comment":comment,
-        "track_name":trackname, "album": album_name, "artists": artists, "trackid": trackid}
-        
-        print(result[ratingid])
+        "album": entry["album"], "artists": entry["artist_names"], "trackid": trackid}
         
+      print(result[ratingid])
       
     
     #
@@ -207,7 +228,7 @@ def lambda_handler(event, context):
     
     return {
       'statusCode': 200,
-      'body': json.dumps(result)
+      'body': json.dumps({"ratings": result, "next_after_ratingid": next_after_ratingid})
     }
     
   except Exception as err:
@@ -219,3 +240,6 @@ def lambda_handler(event, context):
       'body': json.dumps(str(err))
     }
 
+  finally:
+    ttl_cache.log_stats()
+    spotify_utils.log_stats()
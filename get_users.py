@@ -1,14 +1,28 @@
 #
-# Retrieves and returns all the users in the 
-# BenfordApp database.
+# Retrieves and returns the users in the 
+# BenfordApp database, one page at a time. Optional
+# query string parameters:
+#
+#   limit   users per page (see db_utils.page_size)
+#   cursor  next_cursor from the previous page
+#
+# Returns { "users": [...], "next_cursor": "..." }; the
+# cursor is null on the last page.
 #
 
 import json
 import boto3
 import os
 import datatier
+import settings
+import db_utils
+
+
+#
+# one page of users; also EXPLAINed by check_query_plans.py:
+#
+PAGE_SQL = "SELECT * FROM users WHERE userid > %s ORDER BY userid LIMIT %s;"
 
-from configparser import ConfigParser
 
 def lambda_handler(event, context):
   try:
@@ -16,13 +30,10 @@ def lambda_handler(event, context):
     print("**lambda: proj03_users**")
     
     #
-    # setup AWS based on config file:
+    # configuration, read once per container (see
+    # settings.py):
     #
-    config_file = 'benfordapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
+    config = settings.get('benfordapp-config.ini')
     
     #
     # configure for S3 access:
@@ -35,21 +46,13 @@ def lambda_handler(event, context):
     #s3 = boto3.resource('s3')
     #bucket = s3.Bucket(bucketname)
     
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
 
     #
     # open connection to the database:
     #
     print("**Opening connection**")
     
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
     
     #
     # now retrieve all the users:
@@ -60,9 +63,17 @@ def lambda_handler(event, context):
     # TODO #1 of 1: write sql query to select all users from the 
     # users table, ordered by userid
     #
-    sql = "SELECT * FROM users ORDER BY userid;"
+    #
+    # keyset pagination: each page starts after the last
+    # userid of the previous one, so every page costs the
+    # same however many users there are:
+    #
+    params = event.get("queryStringParameters") or {}
+    
+    limit = db_utils.page_size(params.get("limit"))
+    cursor = params.get("cursor")
     
-    rows = datatier.retrieve_all_rows(dbConn, sql)
+    (rows, next_cursor) = db_utils.retrieve_page(dbConn, PAGE_SQL, [], cursor, limit)
     
     for row in rows:
       print(row)
@@ -75,7 +86,7 @@ def lambda_handler(event, context):
     
     return {
       'statusCode': 200,
-      'body': json.dumps(rows)
+      'body': json.dumps({"users": rows, "next_cursor": next_cursor})
     }
     
   except Exception as err:
@@ -17,6 +17,11 @@ import base64
 from configparser import ConfigParser
 from getpass import getpass
 
+#
+# ratings fetched per get_ratings request:
+#
+RATINGS_PAGE_SIZE = 10
+
 
 ############################################################
 #
@@ -73,6 +78,7 @@ def prompt():
   print("   11 => login *")
   print("   12 => authenticate token *")
   print("   13 => logout")
+  print("   14 => refresh token")
 
   cmd = input()
 
@@ -110,34 +116,48 @@ def users(baseurl):
     api = '/get_users'
     url = baseurl + api
 
-    res = requests.get(url)
-
     #
-    # let's look at what we got back:
+    # the users come back a page at a time; follow the
+    # cursor until there are no more pages:
     #
-    if res.status_code != 200:
-      # failed:
-      print("Failed with status code:", res.status_code)
-      print("url: " + url)
-      if res.status_code == 400:
-        # we'll have an error message
-        body = res.json()
-        print("Error message:", body)
+    users = []
+    cursor = None
+
+    while True:
+      params = {} if cursor is None else {"cursor": cursor}
+
+      res = requests.get(url, params=params)
+
       #
-      return
+      # let's look at what we got back:
+      #
+      if res.status_code != 200:
+        # failed:
+        print("Failed with status code:", res.status_code)
+        print("url: " + url)
+        if res.status_code == 400:
+          # we'll have an error message
+          body = res.json()
+          print("Error message:", body)
+        #
+        return
 
-    #
-    # deserialize and extract users:
-    #
-    body = res.json()
+      #
+      # deserialize and extract users:
+      #
+      body = res.json()
 
-    #
-    # let's map each row into a User object:
-    #
-    users = []
-    for row in body:
-      user = User(row)
-      users.append(user)
+      #
+      # let's map each row into a User object:
+      #
+      for row in body["users"]:
+        user = User(row)
+        users.append(user)
+
+      cursor = body["next_cursor"]
+
+      if cursor is None:
+        break
     #
     # Now we can think OOP:
     #
@@ -164,7 +184,7 @@ def users(baseurl):
 #
 # create_rating
 #
-def create_rating(baseurl, token, musicid=None):
+def create_rating(baseurl, token, musicid=None, kind=None, spotify_token=None):
   """
   Prints out an authenticated user's folder contents
 
@@ -173,6 +193,8 @@ def create_rating(baseurl, token, musicid=None):
   baseurl: baseurl for web service
   token: user authentication token
   music: Spotify API track id
+  kind: "track" or "album" if known
+  spotify_token: Spotify API token, used to keep stats current
 
   Returns
   -------
@@ -216,7 +238,12 @@ def create_rating(baseurl, token, musicid=None):
     # if there is a token, it needs to be passed in the
     # header of /POST 
     data = {"musicid":musicid, "num_stars":num_stars, "comment":comment}
-    res = requests.post(url, json=data)
+    if kind is not None:
+      data["kind"] = kind
+    if spotify_token is not None:
+      data["spotify_token"] = spotify_token
+    req_headers = {"Authentication": token}
+    res = requests.post(url, json=data, headers=req_headers)
 
     #
     # let's look at what we got back:
@@ -289,7 +316,8 @@ def create_folder(baseurl, token):
     # if there is a token, it needs to be passed in the
     # header of /POST 
     data = {"folder_name":folder_name, "token":token}
-    res = requests.post(url, json=data)
+    req_headers = {"Authentication": token}
+    res = requests.post(url, json=data, headers=req_headers)
 
     #
     # let's look at what we got back:
@@ -393,16 +421,22 @@ def search(baseurl, spotify_token):
 
     
     print(
-      '''Supply an track index from above to write a track rating or add to a folder (or press enter to exit)>
+      '''Supply an track index from above (or several, separated by commas, or "all") to write a track rating or add to a folder (or press enter to exit)>
       ''')
     while True:
-      track_index = input()
-      if track_index == "":
+      indices = input()
+      if indices == "":
         return
-      elif not track_index.isnumeric():
-        track_index = -1
-      track_index = int(track_index)
-      if track_index < 1 or track_index > len(track_list):
+      if indices.strip().lower() == "all":
+        track_indices = list(track_list.keys())
+      else:
+        track_indices = []
+        for track_index in indices.split(","):
+          track_index = track_index.strip()
+          if not track_index.isnumeric():
+            track_index = -1
+          track_indices.append(int(track_index))
+      if not track_indices or any(track_index < 1 or track_index > len(track_list) for track_index in track_indices):
         print("Invalid Track index")
       
       else:
@@ -421,10 +455,22 @@ def search(baseurl, spotify_token):
         print("Invalid Option")
       else: break
 
+    #
+    # album searches return albums, every other search
+    # type returns tracks:
+    #
+    kind = "album" if type_param == "album" else "track"
+
+    musicids = [track_list[track_index] for track_index in track_indices]
+
     if option == 1:
-      create_rating(baseurl, token, track_list[track_index])
+      for musicid in musicids:
+        create_rating(baseurl, token, musicid, kind, spotify_token)
     elif option == 2:
-      add_to_folder(baseurl, token, track_list[track_index])
+      #
+      # all the chosen tracks go in one request:
+      #
+      add_to_folder(baseurl, token, musicids, kind)
 
         ### add content here for function
       
@@ -446,7 +492,7 @@ def search(baseurl, spotify_token):
 #
 def get_ratings(baseurl, token, spotify_token):
   """
-  Prints out a user's ratings
+  Prints out a user's ratings, a page at a time
 
   Parameters
   ----------
@@ -472,60 +518,75 @@ def get_ratings(baseurl, token, spotify_token):
     api = '/get_ratings'
     url = baseurl + api + '/' + spotify_token
 
-    #
-    # make request:
-    #
+    print("Ratings:   ")
 
-    # if there is a token, it needs to be passed in the 
-    # header of /GET jobs
-    req_headers = {"Authentication": token}
-    res = requests.get(url, headers=req_headers)
+    index = 1
+    after_ratingid = None
 
-    #
-    # let's look at what we got back:
-    #
-    if res.status_code != 200:
-      if res.status_code == 401:
-        body = res.json()
-        print(body)
-        return
-      if res.status_code == 400:
-        # we'll have an error message
-        body = res.json()
-        print(body)
-        return
-      # failed:
-      print("Failed with status code:", res.status_code)
-      print("url: " + url)
+    while True:
+      #
+      # make request:
       #
-      return
-    #
-    # deserialize and extract jobs:
-    #
-    body = res.json()
-    #
-    # printing in a nice way:
-    #
-    print("Ratings:   ")
 
-    if not body:
-      print("no ratings...")
-      return
+      # if there is a token, it needs to be passed in the 
+      # header of /GET jobs
+      req_headers = {"Authentication": token}
+      params = {"limit": RATINGS_PAGE_SIZE}
+      if after_ratingid is not None:
+        params["after_ratingid"] = after_ratingid
+      res = requests.get(url, headers=req_headers, params=params)
 
-    for index, (ratingid, info) in enumerate(body.items(), start=1):
-      if "track_name" in info:
-          print(f"{index}. {info['track_name']}")
-      elif "album" in info:
-          print(f"{index}. {info['album']}")  # In case there's no track name, print the trackid
-      if "album" in info:
-        print(f"    Album: {info['album']}")
+      #
+      # let's look at what we got back:
+      #
+      if res.status_code != 200:
+        if res.status_code == 401:
+          body = res.json()
+          print(body)
+          return
+        if res.status_code == 400:
+          # we'll have an error message
+          body = res.json()
+          print(body)
+          return
+        # failed:
+        print("Failed with status code:", res.status_code)
+        print("url: " + url)
+        #
+        return
+      #
+      # deserialize and extract jobs:
+      #
+      body = res.json()
+      ratings = body["ratings"]
+      after_ratingid = body["next_after_ratingid"]
+      #
+      # printing in a nice way:
+      #
+      if not ratings and index == 1 and after_ratingid is None:
+        print("no ratings...")
+        return
 
-      print(f"    Artist: {', '.join(info['artists'])}")
-      print(f"    Stars: {info['num_stars']}")
-      print(f"    Comment: {info['comment']}")
-      print()
-    #
-    return
+      for ratingid, info in ratings.items():
+        if "track_name" in info:
+            print(f"{index}. {info['track_name']}")
+        elif "album" in info:
+            print(f"{index}. {info['album']}")  # In case there's no track name, print the trackid
+        if "album" in info:
+          print(f"    Album: {info['album']}")
+
+        print(f"    Artist: {', '.join(info['artists'])}")
+        print(f"    Stars: {info['num_stars']}")
+        print(f"    Comment: {info['comment']}")
+        print()
+        index += 1
+
+      if after_ratingid is None:
+        return
+
+      more = input("more ratings? [y/n] ")
+      if more.lower() != "y":
+        return
 
   except Exception as e:
     logging.error("get ratings failed:")
@@ -626,15 +687,17 @@ def get_folders(baseurl, token):
 #
 # add_to_folder
 #
-def add_to_folder(baseurl, token, musicid=None):
+def add_to_folder(baseurl, token, musicid=None, kind=None):
   """
-  Adds a singular song or album to a folder
+  Adds one or more songs or albums to a folder, in a
+  single request
 
   Parameters
   ----------
   baseurl: baseurl for web service
   token: user authentication token
-  musicid: Spotify id
+  musicid: Spotify id, or a list of them
+  kind: "track" or "album" if known
 
   Returns
   -------
@@ -646,9 +709,9 @@ def add_to_folder(baseurl, token, musicid=None):
     return
   
   if musicid is None:
-    print("Give the musicid>")
-    musicid = input()
-  if musicid == "":
+    print("Give the musicid (or several, separated by commas)>")
+    musicid = [value.strip() for value in input().split(",") if value.strip()]
+  if musicid == "" or musicid == []:
     print("bad input")
     return
     
@@ -692,8 +755,12 @@ def add_to_folder(baseurl, token, musicid=None):
 
     # if there is a token, it needs to be passed in the
     # header of /POST 
-    data = {"musicid":musicid, "token":token, "folderid":folder_id}
-    res = requests.post(url, json=data)
+    musicids = musicid if isinstance(musicid, list) else [musicid]
+    data = {"musicids":musicids, "token":token, "folderid":folder_id}
+    if kind is not None:
+      data["kind"] = kind
+    req_headers = {"Authentication": token}
+    res = requests.post(url, json=data, headers=req_headers)
 
     #
     # let's look at what we got back:
@@ -714,7 +781,15 @@ def add_to_folder(baseurl, token, musicid=None):
       #
       return
 
-    print("Success! You've added a song to your folder!")
+    body = res.json()
+
+    if len(musicids) == 1:
+      print("Success! You've added a song to your folder!")
+    else:
+      print(f"Success! You've added {body['added']} songs to your folder!")
+
+    if body["already_present"] > 0:
+      print(f"({body['already_present']} already in the folder)")
 
     return
 
@@ -1196,6 +1271,129 @@ def authenticate(baseurl, token):
     return
 
 
+############################################################
+#
+# refresh
+#
+def refresh(baseurl, token):
+  """
+  Extends the current token's expiration without logging
+  in again.
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+  token: user authentication token
+
+  Returns
+  -------
+  the token to use from now on (the same token, or a new
+  one if the service re-issued it); the old token if the
+  refresh failed
+  """
+
+  try:
+    if token is None:
+      print("No current token, please login")
+      return token
+
+    duration = input("# of minutes before expiration? ")
+
+    data = {"token": token, "refresh": True}
+
+    if duration.isnumeric():
+      data["duration"] = duration
+
+    api = '/auth'
+    url = baseurl + api
+
+    res = requests.post(url, json=data)
+
+    #
+    # let's look at what we got back:
+    #
+    if res.status_code == 401:
+      #
+      # token no longer valid, must login again:
+      #
+      body = res.json()
+      print(body)
+      return token
+
+    if res.status_code != 200:
+      # failed:
+      print("Failed with status code:", res.status_code)
+      print("url: " + url)
+      if res.status_code == 400:
+        # we'll have an error message
+        body = res.json()
+        print("Error message:", body)
+      #
+      return token
+
+    #
+    # success, token extended:
+    #
+    body = res.json()
+
+    print("token refreshed, expires (UTC):", body["expiration_utc"])
+
+    return body["token"]
+
+  except Exception as e:
+    logging.error("refresh() failed:")
+    logging.error("url: " + url)
+    logging.error(e)
+    return token
+
+
+############################################################
+#
+# logout
+#
+def logout(baseurl, token):
+  """
+  Revokes the current token so it can no longer be used.
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+  token: user authentication token
+
+  Returns
+  -------
+  nothing
+  """
+
+  try:
+    if token is None:
+      return
+
+    data = {"token": token, "revoke": True}
+
+    api = '/auth'
+    url = baseurl + api
+
+    res = requests.post(url, json=data)
+
+    #
+    # an expired or unknown token is as good as revoked:
+    #
+    if res.status_code != 200 and res.status_code != 401:
+      print("Failed with status code:", res.status_code)
+      print("url: " + url)
+      return
+
+    print("logged out")
+    return
+
+  except Exception as e:
+    logging.error("logout() failed:")
+    logging.error("url: " + url)
+    logging.error(e)
+    return
+
+
 ############################################################
 # main
 #
@@ -1266,7 +1464,7 @@ try:
     if cmd == 1:
       users(baseurl)
     elif cmd == 2:
-      create_rating(baseurl, token, musicid=None)
+      create_rating(baseurl, token, musicid=None, spotify_token=spotify_token)
     elif cmd == 3:
       create_folder(baseurl, token)
     elif cmd == 4:
@@ -1293,7 +1491,10 @@ try:
       #
       # logout
       #
+      logout(baseurl, token)
       token = None
+    elif cmd == 14:
+      token = refresh(baseurl, token)
     else:
       print("** Unknown command, try again...")
     #
@@ -0,0 +1,22 @@
+--
+-- Spotify metadata shared by the MusicApp read lambdas
+-- (get_ratings, user_stats, open_folder). Rows are written
+-- through whenever a lambda fetches from Spotify, and are
+-- considered fresh for a configurable TTL based on fetched_at.
+--
+-- artist_names, artist_ids and genres hold JSON arrays.
+--
+
+CREATE TABLE IF NOT EXISTS music_metadata (
+  musicid       varchar(64)  NOT NULL,
+  kind          varchar(16)  NOT NULL,  -- track, album or artist
+  name          varchar(512) NOT NULL,
+  album         varchar(512) NULL,
+  album_id      varchar(64)  NULL,
+  artist_names  text         NOT NULL,
+  artist_ids    text         NOT NULL,
+  genres        text         NOT NULL,
+  fetched_at    datetime     NOT NULL,
+  PRIMARY KEY (musicid),
+  KEY music_metadata_fetched_at (fetched_at)
+);
@@ -0,0 +1,12 @@
+--
+-- Record whether a rated / saved musicid is a Spotify track
+-- or album, so the read lambdas can send each id straight
+-- to the right multi-id endpoint. NULL means not yet known;
+-- run backfill_music_kind to classify existing rows.
+--
+
+ALTER TABLE ratings
+  ADD COLUMN kind varchar(16) NULL;
+
+ALTER TABLE folder_music
+  ADD COLUMN kind varchar(16) NULL;
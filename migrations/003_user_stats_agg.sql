@@ -0,0 +1,25 @@
+--
+-- Incrementally maintained per-user rating statistics.
+-- create_rating updates these in the same transaction as
+-- the ratings INSERT; user_stats reads them back with one
+-- indexed range read per category. stale = 1 means the
+-- aggregates must be rebuilt from the ratings table
+-- (see rebuild_user_stats).
+--
+
+CREATE TABLE IF NOT EXISTS user_stats_agg (
+  userid        int      NOT NULL,
+  star_sum      int      NOT NULL DEFAULT 0,
+  rating_count  int      NOT NULL DEFAULT 0,
+  stale         tinyint  NOT NULL DEFAULT 1,
+  PRIMARY KEY (userid)
+);
+
+CREATE TABLE IF NOT EXISTS user_stats_counters (
+  userid    int          NOT NULL,
+  category  varchar(16)  NOT NULL,  -- album, artist, genre or track
+  name      varchar(255) NOT NULL,
+  weight    int          NOT NULL DEFAULT 0,
+  PRIMARY KEY (userid, category, name),
+  KEY user_stats_counters_top (userid, category, weight)
+);
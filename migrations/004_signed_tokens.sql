@@ -0,0 +1,11 @@
+--
+-- Support for stateless signed session tokens (see
+-- session_tokens.py). Signed tokens are not stored at
+-- login; the tokens table records revocations instead, for
+-- both classic and signed tokens. Signed tokens are longer
+-- than uuids, so widen the token column to hold them.
+--
+
+ALTER TABLE tokens
+  MODIFY COLUMN token varchar(128) NOT NULL,
+  ADD COLUMN revoked tinyint NOT NULL DEFAULT 0;
@@ -0,0 +1,13 @@
+--
+-- Index plan for the tokens table. Every authenticated
+-- request looks a token up by value, and sweep_tokens
+-- deletes expired rows by expiration_utc in LIMIT-sized
+-- batches; without these indexes both are full scans of a
+-- table that gains a row on every login. The unique index
+-- on token also keeps auth_utils.revoke_token from adding a
+-- second row when a signed token is revoked twice.
+--
+
+CREATE UNIQUE INDEX tokens_token ON tokens (token);
+
+CREATE INDEX tokens_expiration_utc ON tokens (expiration_utc);
@@ -0,0 +1,33 @@
+--
+-- One row per (folderid, musicid), so add_to_folder can use
+-- a multi-row INSERT ... ON DUPLICATE KEY UPDATE and a
+-- retried request never adds the same music twice.
+--
+-- Existing duplicates are removed in place, so the table
+-- keeps its foreign keys and no concurrent writes are lost:
+-- each duplicated (folderid, musicid) is deleted and put
+-- back once, inside one transaction. If a duplicate sneaks
+-- in before the ALTER, the ALTER fails and this can simply
+-- be run again.
+--
+
+START TRANSACTION;
+
+CREATE TEMPORARY TABLE folder_music_dups AS
+  SELECT folderid, musicid, MAX(kind) AS kind
+  FROM folder_music
+  GROUP BY folderid, musicid
+  HAVING COUNT(*) > 1;
+
+DELETE folder_music FROM folder_music
+  JOIN folder_music_dups USING (folderid, musicid);
+
+INSERT INTO folder_music (folderid, musicid, kind)
+  SELECT folderid, musicid, kind FROM folder_music_dups;
+
+COMMIT;
+
+DROP TEMPORARY TABLE folder_music_dups;
+
+ALTER TABLE folder_music
+  ADD UNIQUE KEY folder_music_folder_music (folderid, musicid);
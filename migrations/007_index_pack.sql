@@ -0,0 +1,37 @@
+--
+-- Indexes for the hot queries of the MusicApp lambdas, so
+-- none of them needs a full table scan or a filesort.
+-- check_query_plans.py runs EXPLAIN on each of these queries
+-- and reports any that still do.
+--
+-- Already covered by earlier migrations:
+--   tokens.token, tokens.expiration_utc    005
+--   folder_music.folderid                  006 (folderid, musicid)
+--
+-- The user_stats read path no longer sorts ratings by
+-- num_stars (it reads user_stats_agg / user_stats_counters),
+-- so no (userid, num_stars) index is added; it would only
+-- slow down create_rating.
+--
+
+-- get_ratings: WHERE userid = ? AND ratingid > ? ORDER BY ratingid;
+-- user_stats_agg.rebuild: WHERE userid = ?
+CREATE INDEX ratings_userid_ratingid ON ratings (userid, ratingid);
+
+-- get_folders: WHERE userid = ?
+CREATE INDEX folders_userid ON folders (userid);
+
+-- add_user: WHERE email = ?; auth login: WHERE username = ?
+CREATE INDEX users_email ON users (email);
+CREATE INDEX users_username ON users (username);
+
+-- auth_utils revoked token set: WHERE revoked = 1 AND expiration_utc > ?
+CREATE INDEX tokens_revoked_expiration ON tokens (revoked, expiration_utc);
+
+-- user_stats_agg.read: ORDER BY weight DESC, name per
+-- (userid, category); include name, descending weight, so
+-- the top-k comes straight off the index without a filesort
+-- (descending index parts need MySQL 8.0 or later)
+ALTER TABLE user_stats_counters
+  DROP INDEX user_stats_counters_top,
+  ADD INDEX user_stats_counters_top (userid, category, weight DESC, name);
@@ -0,0 +1,14 @@
+--
+-- user_stats_counters.name holds Spotify track, album,
+-- artist and genre names, which can exceed 255 characters.
+-- Widen the column (user_stats_agg.weights_for truncates
+-- to NAME_LENGTH = 512), and compare names byte for byte
+-- so names differing only in case or accents stay
+-- separate counters.
+--
+-- Key length: 4 + 16*4+2 + 512*4+2 = 2120 bytes, under the
+-- 3072-byte InnoDB limit.
+--
+
+ALTER TABLE user_stats_counters
+  MODIFY name varchar(512) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL;
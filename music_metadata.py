@@ -0,0 +1,270 @@
+#
+# Read-through / write-through cache of Spotify metadata
+# in the music_metadata table of the MusicApp database.
+#
+# Track, album and artist names rarely change, so the read
+# lambdas look here first and only go to Spotify for ids
+# that are missing or older than the TTL.
+#
+
+import os
+import json
+import datatier
+import settings
+import spotify_utils
+import ttl_cache
+
+
+DEFAULT_TTL = settings.DEFAULT_METADATA_TTL  # seconds
+
+#
+# keep IN (...) lists to a reasonable size:
+#
+LOOKUP_CHUNK = 500
+
+#
+# formatted with one %s placeholder per id; also
+# EXPLAINed by check_query_plans.py:
+#
+LOOKUP_SQL = """
+  SELECT musicid, kind, name, album, album_id, artist_names, artist_ids, genres
+  FROM music_metadata
+  WHERE musicid IN ({placeholders})
+    AND fetched_at > UTC_TIMESTAMP() - INTERVAL %s SECOND
+  """
+
+#
+# in-process caches in front of the table, one per kind,
+# that live as long as the warm container:
+#
+CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "4096"))
+CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", "3600"))  # seconds
+
+_caches = {
+  "tracks": ttl_cache.get_cache("track", CACHE_SIZE, CACHE_TTL),
+  "albums": ttl_cache.get_cache("album", CACHE_SIZE, CACHE_TTL),
+  "artists": ttl_cache.get_cache("artist", CACHE_SIZE, CACHE_TTL)
+}
+
+_kinds = {"track": "tracks", "album": "albums", "artist": "artists"}
+
+
+def _remember(entry):
+  _caches[_kinds[entry["kind"]]].put(entry["musicid"], entry)
+
+
+def from_spotify(kind, item):
+  """
+  Converts a Spotify track, album or artist object into a
+  metadata entry
+
+  Parameters
+  ----------
+  kind: "tracks", "albums" or "artists"
+  item: Spotify object
+
+  Returns
+  -------
+  dictionary with musicid, kind, name, album, album_id,
+  artist_names, artist_ids and genres
+  """
+  if kind == "tracks":
+    album = item.get("album") or {}
+    return {
+      "musicid": item["id"],
+      "kind": "track",
+      "name": item["name"],
+      "album": album.get("name", "None"),
+      "album_id": album.get("id"),
+      "artist_names": [artist["name"] for artist in item["artists"]],
+      "artist_ids": [artist["id"] for artist in item["artists"]],
+      "genres": []
+    }
+
+  if kind == "albums":
+    return {
+      "musicid": item["id"],
+      "kind": "album",
+      "name": item["name"],
+      "album": item["name"],
+      "album_id": item["id"],
+      "artist_names": [artist["name"] for artist in item["artists"]],
+      "artist_ids": [artist["id"] for artist in item["artists"]],
+      "genres": item.get("genres", [])
+    }
+
+  return {
+    "musicid": item["id"],
+    "kind": "artist",
+    "name": item["name"],
+    "album": None,
+    "album_id": None,
+    "artist_names": [item["name"]],
+    "artist_ids": [item["id"]],
+    "genres": item.get("genres", [])
+  }
+
+
+def lookup(dbConn, musicids, ttl=DEFAULT_TTL):
+  """
+  Retrieves the metadata entries that are fresher than ttl
+
+  Parameters
+  ----------
+  dbConn: open connection to the MusicApp database
+  musicids: list of Spotify ids
+  ttl: maximum age of an entry, in seconds
+
+  Returns
+  -------
+  dictionary mapping musicid => entry
+  """
+  musicids = list(dict.fromkeys(musicids))
+
+  found = {}
+
+  for start in range(0, len(musicids), LOOKUP_CHUNK):
+    chunk = musicids[start:start + LOOKUP_CHUNK]
+    placeholders = ", ".join(["%s"] * len(chunk))
+
+    sql = LOOKUP_SQL.format(placeholders=placeholders)
+
+    rows = datatier.retrieve_all_rows(dbConn, sql, chunk + [int(ttl)])
+
+    for row in rows:
+      found[row[0]] = {
+        "musicid": row[0],
+        "kind": row[1],
+        "name": row[2],
+        "album": row[3],
+        "album_id": row[4],
+        "artist_names": json.loads(row[5]),
+        "artist_ids": json.loads(row[6]),
+        "genres": json.loads(row[7])
+      }
+
+  return found
+
+
+def store(dbConn, entries):
+  """
+  Inserts or refreshes metadata entries, stamping them
+  with the current time
+
+  Parameters
+  ----------
+  dbConn: open connection to the MusicApp database
+  entries: list of entries from from_spotify()
+
+  Returns
+  -------
+  nothing
+  """
+  if not entries:
+    return
+
+  placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, UTC_TIMESTAMP())"] * len(entries))
+
+  sql = f"""
+        INSERT INTO music_metadata
+          (musicid, kind, name, album, album_id, artist_names, artist_ids, genres, fetched_at)
+        VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE
+          kind = VALUES(kind), name = VALUES(name), album = VALUES(album),
+          album_id = VALUES(album_id), artist_names = VALUES(artist_names),
+          artist_ids = VALUES(artist_ids), genres = VALUES(genres),
+          fetched_at = VALUES(fetched_at)
+        """
+
+  parameters = []
+  for entry in entries:
+    parameters += [entry["musicid"], entry["kind"], entry["name"], entry["album"],
+                   entry["album_id"], json.dumps(entry["artist_names"]),
+                   json.dumps(entry["artist_ids"]), json.dumps(entry["genres"])]
+
+  datatier.perform_action(dbConn, sql, parameters)
+
+
+def hydrate(dbConn, musicids, headers, ttl=DEFAULT_TTL, kinds=("tracks", "albums"), known_kinds=None):
+  """
+  Returns metadata for the given ids, checking the
+  in-process cache, then the music_metadata table, and
+  fetching only the missing or stale ids from Spotify.
+  Whatever is fetched is written back to the table.
+
+  Parameters
+  ----------
+  dbConn: open connection to the MusicApp database
+  musicids: list of Spotify ids
+  headers: request headers from spotify_utils.auth_headers(),
+           or None to only use metadata that is already stored
+  ttl: maximum age of a stored entry, in seconds
+  kinds: Spotify endpoints to try, in order, for ids that
+         are not already stored
+  known_kinds: optional dictionary musicid => "track" or
+               "album"; those ids are only looked up as that
+               kind instead of trying each of kinds in turn
+
+  Returns
+  -------
+  dictionary mapping musicid => entry, ids Spotify could
+  not resolve are left out
+  """
+  if known_kinds is None:
+    known_kinds = {}
+
+  def candidate_kinds(musicid):
+    known = known_kinds.get(musicid)
+    if known in _kinds:
+      return [_kinds[known]]
+    return kinds
+
+  found = {}
+
+  for musicid in dict.fromkeys(musicids):
+    #
+    # an id of unknown kind is probed in each kind's cache;
+    # only the last probe counts a miss, so the counters
+    # see one hit or one miss per id:
+    #
+    candidates = candidate_kinds(musicid)
+    for kind in candidates:
+      entry = _caches[kind].get(musicid, count_miss=(kind == candidates[-1]))
+      if entry is not None:
+        found[musicid] = entry
+        break
+
+  missing = [musicid for musicid in dict.fromkeys(musicids) if musicid not in found]
+
+  if missing:
+    stored = lookup(dbConn, missing, ttl)
+
+    for entry in stored.values():
+      _remember(entry)
+
+    found.update(stored)
+    missing = [musicid for musicid in missing if musicid not in stored]
+
+  if headers is None:
+    return found
+
+  fetched = []
+  for kind in kinds:
+    if not missing:
+      break
+
+    candidates = [musicid for musicid in missing if kind in candidate_kinds(musicid)]
+    items = spotify_utils.get_several(kind, candidates, headers)
+
+    for musicid, item in items.items():
+      entry = from_spotify(kind, item)
+      entry["musicid"] = musicid
+      found[musicid] = entry
+      fetched.append(entry)
+      _remember(entry)
+
+    missing = [musicid for musicid in missing if musicid not in items]
+
+  store(dbConn, fetched)
+
+  return found
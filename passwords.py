@@ -0,0 +1,107 @@
+#
+# Password hashing for the MusicApp lambda functions.
+#
+# Hashes are bcrypt, which stores its cost factor (the log2
+# of the number of rounds) inside every hash:
+#
+#   $2b$<cost>$<salt><digest>
+#
+# so hashes made at different costs all keep verifying. The
+# cost used for new hashes comes from PASSWORD_HASH_COST;
+# pick it with calibrate_password_cost for the memory size
+# the login lambda runs at. auth.py rehashes a user's
+# password on a successful login whenever the stored cost
+# differs from the configured one.
+#
+# Hashes written before bcrypt, by the Lambda layer's auth
+# helper, are still checked with that helper; they count as
+# needing a rehash, so each is replaced by a bcrypt hash the
+# next time its user logs in.
+#
+
+import os
+import bcrypt
+
+
+DEFAULT_COST = 12
+
+HASH_COST = int(os.getenv("PASSWORD_HASH_COST", str(DEFAULT_COST)))
+
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+
+def _as_bytes(value):
+  return value if isinstance(value, bytes) else value.encode()
+
+
+def hash_password(pwd, cost=None):
+  """
+  Hashes a password
+
+  Parameters
+  ----------
+  pwd: plain-text password
+  cost: bcrypt cost factor, defaults to HASH_COST
+
+  Returns
+  -------
+  hash as a string, with the cost and salt embedded
+  """
+  salt = bcrypt.gensalt(rounds=cost or HASH_COST)
+
+  return bcrypt.hashpw(_as_bytes(pwd), salt).decode()
+
+
+def is_bcrypt(pwdhash):
+  """
+  Returns True if the hash is in the bcrypt format
+  """
+  if isinstance(pwdhash, bytes):
+    pwdhash = pwdhash.decode()
+
+  return pwdhash.startswith(BCRYPT_PREFIXES)
+
+
+def _legacy_check_password(pwd, pwdhash):
+  #
+  # the layer's helper is only needed for hashes from before
+  # bcrypt, so it is imported on first use:
+  #
+  import auth as legacy_auth
+
+  return legacy_auth.check_password(pwd, pwdhash)
+
+
+def check_password(pwd, pwdhash):
+  """
+  Returns True if the password matches the hash, which may
+  be bcrypt or a legacy hash from the layer's auth helper
+  """
+  if not is_bcrypt(pwdhash):
+    return _legacy_check_password(pwd, pwdhash)
+
+  return bcrypt.checkpw(_as_bytes(pwd), _as_bytes(pwdhash))
+
+
+def cost_of(pwdhash):
+  """
+  Returns the cost factor stored in a bcrypt hash, or None
+  if the hash is not in the bcrypt format
+  """
+  if isinstance(pwdhash, bytes):
+    pwdhash = pwdhash.decode()
+
+  parts = pwdhash.split("$")
+
+  if len(parts) < 4 or not parts[2].isdigit():
+    return None
+
+  return int(parts[2])
+
+
+def needs_rehash(pwdhash):
+  """
+  Returns True if the hash is not bcrypt, or was made at a
+  cost other than the configured HASH_COST
+  """
+  return not is_bcrypt(pwdhash) or cost_of(pwdhash) != HASH_COST
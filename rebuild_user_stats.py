@@ -0,0 +1,97 @@
+#
+# Recomputes the user_stats_agg / user_stats_counters
+# aggregates from the ratings table, for every user with
+# ratings or for one user passed in the event:
+#
+# { "userid": 123, "spotify_token": "..." }
+#
+# Both fields are optional. Without a Spotify token a
+# client-credentials token is requested.
+#
+
+import json
+import boto3
+import os
+import datatier
+import settings
+import db_utils
+import spotify_utils
+import music_metadata
+import user_stats_agg
+import spotify_api_connect
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    spotify_utils.set_deadline(context)
+    print("**lambda: rebuild_user_stats**")
+
+    event = event or {}
+
+    #
+    # configuration, read once per container (see
+    # settings.py):
+    #
+    config = settings.get()
+
+    metadata_ttl = config.metadata_ttl
+
+    #
+    # Spotify token from the event, or mint one:
+    #
+    spotify_token = event.get("spotify_token")
+
+    if not spotify_token:
+      spotify_token = spotify_api_connect.get_access_token()
+
+    if not spotify_token:
+      raise Exception("unable to obtain a Spotify access token")
+
+    headers = spotify_utils.auth_headers(spotify_token)
+
+    #
+    # open connection to the database:
+    #
+    print("**Opening connection**")
+
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
+
+    if "userid" in event:
+      userids = [event["userid"]]
+    else:
+      sql = "SELECT DISTINCT userid FROM ratings ORDER BY userid"
+      userids = [row[0] for row in datatier.retrieve_all_rows(dbConn, sql)]
+
+    for userid in userids:
+      user_stats_agg.rebuild(dbConn, userid, headers, metadata_ttl)
+      print("rebuilt stats for userid", userid)
+
+    print("**DONE, returning count**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps({"users_rebuilt": len(userids)})
+    }
+
+  except spotify_utils.SpotifyError as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return spotify_utils.error_response(err.status_code)
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
+
+
+#
+# allow running from the command line as well:
+#
+if __name__ == "__main__":
+  print(lambda_handler({}, None))
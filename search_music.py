@@ -1,8 +1,9 @@
 import os
 import json
 import base64
-import requests
 import api_utils
+import ttl_cache
+import spotify_utils
 import boto3
 
 from configparser import ConfigParser
@@ -11,9 +12,17 @@ from configparser import ConfigParser
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 
+#
+# search results, kept across warm invocations:
+#
+search_cache = ttl_cache.get_cache("search",
+                                   int(os.getenv("SEARCH_CACHE_SIZE", "512")),
+                                   int(os.getenv("SEARCH_CACHE_TTL", "300")))
+
 def lambda_handler(event, context):
     try:
         print("**STARTING**")
+        spotify_utils.set_deadline(context)
 
         #
         # We are expecting a token and type_info and :
@@ -34,13 +43,20 @@ def lambda_handler(event, context):
             }
             
         # Make the request to Spotify API with the provided token
-        headers = {
-            'Authorization': "Bearer " + token,
-            'Content-Type': 'application/json'
-        }
+        headers = spotify_utils.auth_headers(token)
         
         print("** HEADERS:", headers)
         
+        #
+        # repeat searches are answered from the warm container:
+        #
+        cache_key = (type_info, query)
+        cached = search_cache.get(cache_key)
+        
+        if cached is not None:
+            print("**search cache hit**")
+            return api_utils.success(200, cached)
+        
         url = "https://api.spotify.com/v1/search"
         #
         # if type_info == artist, get artist's 20 top tracks
@@ -49,25 +65,7 @@ def lambda_handler(event, context):
             url_info = f"?q={query}&type={type_info}&limit=1"
             
             query_url = url + url_info
-            response = requests.get(query_url, headers=headers)
-            data = response.json()
-            
-            # Check the status code of the response
-            if response.status_code != 200:
-                if response.status_code == 401:
-                    return {
-                        'statusCode': response.status_code,
-                        'body': json.dumps("error: Spotify API has a bad or expired token")
-                    }
-                if response.status_code == 403:
-                    return {
-                        'statusCode': response.status_code,
-                        'body': json.dumps("error: Spotify API has bad OAuth request")
-                    }
-                return {
-                    'statusCode': response.status_code,
-                    'body': json.dumps("error: Spotify API error")
-                }
+            data = spotify_utils.get_json(query_url, headers)
                 
             json_result = data["artists"]["items"]
             if len(json_result) == 0:
@@ -78,8 +76,7 @@ def lambda_handler(event, context):
             
             # now we can look up 20 top songs of artist
             url = f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks?country=US"
-            response = requests.get(url, headers=headers)
-            data = response.json()
+            data = spotify_utils.get_json(url, headers)
             
             result = {}
             
@@ -91,6 +88,8 @@ def lambda_handler(event, context):
                 
                 result[track_name] = {"album": album_name, "artists": artists, "trackid": trackid}
             
+            search_cache.put(cache_key, result)
+            
             # Return the response from Spotify API
             return {
                 'statusCode': 200,
@@ -103,25 +102,7 @@ def lambda_handler(event, context):
         elif type_info == "genre":
             url = f"https://api.spotify.com/v1/recommendations?limit=20&market=US&seed_genres={query}"
             
-            response = requests.get(url, headers=headers)
-            data = response.json()
-            
-            # Check the status code of the response
-            if response.status_code != 200:
-                if response.status_code == 401:
-                    return {
-                        'statusCode': response.status_code,
-                        'body': json.dumps("error: Spotify API has a bad or expired token")
-                    }
-                if response.status_code == 403:
-                    return {
-                        'statusCode': response.status_code,
-                        'body': json.dumps("error: Spotify API has bad OAuth request")
-                    }
-                return {
-                    'statusCode': response.status_code,
-                    'body': json.dumps("error: Spotify API error")
-                }
+            data = spotify_utils.get_json(url, headers)
                 
             json_result = data["tracks"]
             
@@ -139,6 +120,8 @@ def lambda_handler(event, context):
                 result[track_name] = {"album": album_name, "artists": artists, "trackid": trackid}
             
                 
+            search_cache.put(cache_key, result)
+            
             # Return the response from Spotify API
             return api_utils.success(200, result)
             
@@ -149,25 +132,7 @@ def lambda_handler(event, context):
         elif type_info == "track":
             url = f"https://api.spotify.com/v1/search?q={query}&type=track&market=US&limit=5"
             
-            response = requests.get(url, headers=headers)
-            data = response.json()
-            
-            # Check the status code of the response
-            if response.status_code != 200:
-                if response.status_code == 401:
-                    return {
-                        'statusCode': response.status_code,
-                        'body': json.dumps("error: Spotify API has a bad or expired token")
-                    }
-                if response.status_code == 403:
-                    return {
-                        'statusCode': response.status_code,
-                        'body': json.dumps("error: Spotify API has bad OAuth request")
-                    }
-                return {
-                    'statusCode': response.status_code,
-                    'body': json.dumps("error: Spotify API error")
-                }
+            data = spotify_utils.get_json(url, headers)
                 
             json_result = data["tracks"]
             if len(json_result) == 0:
@@ -183,6 +148,8 @@ def lambda_handler(event, context):
                 
                 result[track_name] = {"album": album_name, "artists": artists, "trackid": trackid}
                 
+            search_cache.put(cache_key, result)
+            
             # Return the response from Spotify API
             return {
                 'statusCode': 200,
@@ -195,25 +162,7 @@ def lambda_handler(event, context):
         elif type_info == "album":
             url = f"https://api.spotify.com/v1/search?q={query}&type=album&market=US&limit=10"
             
-            response = requests.get(url, headers=headers)
-            data = response.json()
-            
-            # Check the status code of the response
-            if response.status_code != 200:
-                if response.status_code == 401:
-                    return {
-                        'statusCode': response.status_code,
-                        'body': json.dumps("error: Spotify API has a bad or expired token")
-                    }
-                if response.status_code == 403:
-                    return {
-                        'statusCode': response.status_code,
-                        'body': json.dumps("error: Spotify API has bad OAuth request")
-                    }
-                return {
-                    'statusCode': response.status_code,
-                    'body': json.dumps("error: Spotify API error")
-                }
+            data = spotify_utils.get_json(url, headers)
                 
             json_result = data["albums"]
             if len(json_result) == 0:
@@ -229,6 +178,8 @@ def lambda_handler(event, context):
                 result[track_name] = {"artists": artists, "trackid": trackid} 
                 
                 
+            search_cache.put(cache_key, result)
+            
             # Return the response from Spotify API
             return {
                 'statusCode': 200,
@@ -240,34 +191,10 @@ def lambda_handler(event, context):
         
         
         
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-            
-        data = response.json()
-    
-        # Check the status code of the response
-        if response.status_code != 200:
-            if response.status_code == 401:
-                return {
-                    'statusCode': response.status_code,
-                    'body': json.dumps({
-                        'error': f"Spotify API has a bad or expired token"
-                    })
-                }
-            if response.status_code == 403:
-                return {
-                    'statusCode': response.status_code,
-                    'body': json.dumps({
-                        'error': f"Spotify API has bad OAuth request"
-                    })
-                }
-            return {
-                'statusCode': response.status_code,
-                'body': json.dumps({
-                    'error': f"Spotify API error"
-                })
-            }
+        data = spotify_utils.get_json(url, headers)
     
+        search_cache.put(cache_key, data)
+        
         # Return the response from Spotify API
         return {
             'statusCode': 200,
@@ -275,6 +202,11 @@ def lambda_handler(event, context):
         }
 
     
+    except spotify_utils.SpotifyError as error:
+        print("**ERROR**")
+        print(str(error))
+        return spotify_utils.error_response(error.status_code)
+    
     except Exception as error:
         print("**ERROR**")
         print(str(error))
@@ -289,4 +221,8 @@ def lambda_handler(event, context):
                 'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
             }
         }
+    
+    finally:
+        ttl_cache.log_stats()
+        spotify_utils.log_stats()
 
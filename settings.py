@@ -0,0 +1,94 @@
+#
+# Configuration for the MusicApp lambda functions, read once
+# per container.
+#
+# The first call to get() reads the config file, points
+# AWS_SHARED_CREDENTIALS_FILE at it, and builds an immutable
+# Settings object; warm invocations get the same object back
+# without touching the file again. Every value can be
+# overridden by an environment variable set in the Lambda
+# console:
+#
+#   RDS_ENDPOINT, RDS_PORT_NUMBER, RDS_USER_NAME,
+#   RDS_USER_PWD, RDS_DB_NAME, METADATA_TTL
+#
+
+import os
+import threading
+
+from collections import namedtuple
+from configparser import ConfigParser
+
+
+DEFAULT_CONFIG_FILE = 'musicapp-config.ini'
+DEFAULT_METADATA_TTL = 7 * 24 * 60 * 60  # seconds
+
+Settings = namedtuple("Settings", [
+  "config_file",
+  "rds_endpoint",
+  "rds_portnum",
+  "rds_username",
+  "rds_pwd",
+  "rds_dbname",
+  "metadata_ttl",
+])
+
+_settings = {}  # config file => Settings
+_lock = threading.Lock()
+
+
+def _value(configur, env_name, section, option, fallback=None):
+  value = os.getenv(env_name)
+
+  if value is not None:
+    return value
+
+  if fallback is None:
+    # required: missing values raise, as before
+    return configur.get(section, option)
+
+  return configur.get(section, option, fallback=fallback)
+
+
+def load(config_file):
+  """
+  Reads the config file and environment into a new Settings
+  object. Handlers should call get() instead.
+  """
+  os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+  configur = ConfigParser()
+  configur.read(config_file)
+
+  return Settings(
+    config_file=config_file,
+    rds_endpoint=_value(configur, "RDS_ENDPOINT", 'rds', 'endpoint'),
+    rds_portnum=int(_value(configur, "RDS_PORT_NUMBER", 'rds', 'port_number')),
+    rds_username=_value(configur, "RDS_USER_NAME", 'rds', 'user_name'),
+    rds_pwd=_value(configur, "RDS_USER_PWD", 'rds', 'user_pwd'),
+    rds_dbname=_value(configur, "RDS_DB_NAME", 'rds', 'db_name'),
+    metadata_ttl=int(_value(configur, "METADATA_TTL", 'spotify', 'metadata_ttl',
+                            fallback=DEFAULT_METADATA_TTL)),
+  )
+
+
+def get(config_file=DEFAULT_CONFIG_FILE):
+  """
+  Returns the settings, loading them on the container's
+  first call
+
+  Parameters
+  ----------
+  config_file: name of the config file to read
+
+  Returns
+  -------
+  Settings object
+  """
+  if config_file not in _settings:
+    with _lock:
+      if config_file not in _settings:
+        print("**Loading settings from", config_file, "**")
+        _settings[config_file] = load(config_file)
+
+  return _settings[config_file]
@@ -1,12 +1,28 @@
 import os
 import json
+import time
 import base64
+import threading
 import requests
+import spotify_utils
 
 # Environment variables should be set in the Lambda console
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 
+# Refresh the cached token this many seconds before it expires
+REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "60"))
+
+#
+# The client-credentials token is cached at module scope, so
+# warm invocations reuse it until shortly before it expires.
+# The lock makes sure a burst of logins triggers only one
+# refresh.
+#
+_token = None
+_expires_at = 0.0
+_token_lock = threading.Lock()
+
 def lambda_handler(event, context):
     try:
         print("**STARTING**")
@@ -15,17 +31,18 @@ def lambda_handler(event, context):
         query_string_parameters = event.get('queryStringParameters', {})
         print("Query String Parameters:", query_string_parameters)
         
-        # Retrieve access token from Spotify API
-        access_token = get_access_token()
+        # Retrieve access token from Spotify API (or the cache)
+        access_token, expires_in = get_cached_token()
         if access_token:
-            print("new token received")
+            print("token valid for", expires_in, "more seconds")
             # Call the search function or any other function using the access token
             search(access_token)
             return {
                 'statusCode': 200,
                 'body': json.dumps({
                     "type": "success",
-                    "access_token": access_token
+                    "access_token": access_token,
+                    "expires_in": expires_in
                 }),
                 'headers': {
                     'Access-Control-Allow-Origin': '*',
@@ -50,7 +67,47 @@ def lambda_handler(event, context):
             }
         }
 
+def get_cached_token():
+    """
+    Returns the cached client-credentials token, requesting a
+    new one from Spotify only if it is missing or about to
+    expire.
+
+    Returns
+    -------
+    (access_token, seconds until it expires), or (None, 0) if
+    a new token could not be obtained
+    """
+    global _token, _expires_at
+
+    now = time.time()
+    if _token is not None and now < _expires_at - REFRESH_MARGIN:
+        return (_token, int(_expires_at - now))
+
+    with _token_lock:
+        #
+        # another thread may have refreshed the token while
+        # we were waiting for the lock:
+        #
+        now = time.time()
+        if _token is not None and now < _expires_at - REFRESH_MARGIN:
+            return (_token, int(_expires_at - now))
+
+        json_response = request_token()
+        if json_response is None or not json_response.get('access_token'):
+            return (None, 0)
+
+        _token = json_response['access_token']
+        _expires_at = now + int(json_response.get('expires_in', 3600))
+
+        print("new token received")
+        return (_token, int(_expires_at - now))
+
 def get_access_token():
+    access_token, expires_in = get_cached_token()
+    return access_token
+
+def request_token():
     url = 'https://accounts.spotify.com/api/token'
     encoded = base64.b64encode(f"{CLIENT_ID}:{CLIENT_SECRET}".encode()).decode()
     print("encoded =", encoded)
@@ -65,11 +122,11 @@ def get_access_token():
     }
 
     try:
-        response = requests.post(url, headers=headers, data=data)
+        response = spotify_utils.session.post(url, headers=headers, data=data, timeout=spotify_utils.TIMEOUT)
         response.raise_for_status()
         json_response = response.json()
         print(json.dumps(json_response, indent=2))
-        return json_response.get('access_token')
+        return json_response
     except requests.RequestException as e:
         print(f"HTTP request failed: {e}")
         return None
@@ -0,0 +1,491 @@
+#
+# Helper functions for talking to the Spotify Web API
+# from the MusicApp lambda functions. Every call to Spotify
+# should go through this module, so connection pooling,
+# timeouts, rate limiting and latency metrics apply to all
+# of the lambdas at once.
+#
+
+import os
+import re
+import json
+import time
+import bisect
+import random
+import threading
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+
+#
+# Spotify's multi-get endpoints cap how many ids can be
+# passed in a single request:
+#
+BATCH_SIZES = {
+  "tracks": 50,
+  "albums": 20,
+  "artists": 50
+}
+
+#
+# at most this many requests to Spotify are in flight at
+# once from one container:
+#
+MAX_WORKERS = int(os.getenv("SPOTIFY_MAX_WORKERS", "8"))
+
+#
+# one keep-alive session and thread pool per container,
+# reused across warm invocations so we don't pay a new TLS
+# handshake for every call:
+#
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS))
+session.headers["Accept-Encoding"] = "gzip, deflate"
+
+#
+# (connect, read) timeouts in seconds for every call:
+#
+TIMEOUT = (float(os.getenv("SPOTIFY_CONNECT_TIMEOUT", "3.05")),
+           float(os.getenv("SPOTIFY_READ_TIMEOUT", "10")))
+
+_executor = None
+
+#
+# rate limiting: every thread in the container shares one
+# token bucket of SPOTIFY_MAX_RPS requests per second, and
+# throttled (429) or failed (5xx) calls are retried up to
+# SPOTIFY_MAX_RETRIES times:
+#
+MAX_RPS = float(os.getenv("SPOTIFY_MAX_RPS", "20"))
+MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", "3"))
+MAX_BACKOFF = 30.0  # seconds
+
+#
+# monotonic time by which retries must be done, so a long
+# Retry-After can't run the lambda into its timeout; set per
+# invocation with set_deadline():
+#
+DEADLINE_MARGIN = 2.0  # seconds kept back to respond
+
+_deadline = None
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+#
+# status code reported when Spotify could not be reached
+# or did not answer in time:
+#
+TIMEOUT_STATUS_CODE = 504
+
+#
+# counters for sizing our quota, see log_stats():
+#
+stats = {
+  "requests": 0,
+  "throttled": 0,
+  "retried": 0,
+  "dropped": 0
+}
+
+_stats_lock = threading.Lock()
+
+#
+# per-endpoint latency histograms, in milliseconds; bucket i
+# counts calls faster than LATENCY_BUCKETS[i], the last
+# bucket counts everything slower:
+#
+LATENCY_BUCKETS = [50, 100, 250, 500, 1000, 2500, 5000]
+
+latencies = {}
+
+
+def _count(name):
+  with _stats_lock:
+    stats[name] += 1
+
+
+def _endpoint(url):
+  #
+  # /v1/artists/0OdUWJ0sBjDrqHygGUXeCF/top-tracks => /v1/artists/{id}/top-tracks
+  #
+  path = url.split("://", 1)[-1].split("?", 1)[0]
+  path = path[path.find("/"):] if "/" in path else "/"
+  return re.sub(r"/[0-9A-Za-z]{22}(?=/|$)", "/{id}", path)
+
+
+def _record_latency(url, elapsed_ms):
+  endpoint = _endpoint(url)
+  bucket = bisect.bisect_right(LATENCY_BUCKETS, elapsed_ms)
+
+  with _stats_lock:
+    if endpoint not in latencies:
+      latencies[endpoint] = [0] * (len(LATENCY_BUCKETS) + 1)
+    latencies[endpoint][bucket] += 1
+
+
+class TokenBucket:
+  """
+  Allows rate requests per second on average, with bursts
+  of up to capacity requests. Safe to share between threads.
+  """
+
+  def __init__(self, rate, capacity):
+    self.rate = rate
+    self.capacity = capacity
+    self._tokens = capacity
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def acquire(self):
+    """
+    Blocks until a request may be sent
+    """
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+
+        wait = (1 - self._tokens) / self.rate
+
+      time.sleep(wait)
+
+
+class AdaptiveLimit:
+  """
+  Caps the number of requests in flight. The cap is halved
+  whenever Spotify throttles us and grows back by one after
+  every run of successful calls.
+  """
+
+  def __init__(self, maximum):
+    self.maximum = maximum
+    self.limit = maximum
+    self._in_flight = 0
+    self._successes = 0
+    self._cond = threading.Condition()
+
+  def __enter__(self):
+    with self._cond:
+      while self._in_flight >= self.limit:
+        self._cond.wait()
+      self._in_flight += 1
+
+  def __exit__(self, *exc):
+    with self._cond:
+      self._in_flight -= 1
+      self._cond.notify_all()
+
+  def throttled(self):
+    with self._cond:
+      self.limit = max(1, self.limit // 2)
+      self._successes = 0
+
+  def succeeded(self):
+    with self._cond:
+      self._successes += 1
+      if self._successes >= 10 and self.limit < self.maximum:
+        self.limit += 1
+        self._successes = 0
+        self._cond.notify_all()
+
+
+_bucket = TokenBucket(MAX_RPS, max(1.0, MAX_RPS))
+_limit = AdaptiveLimit(MAX_WORKERS)
+
+
+def _get_executor():
+  global _executor
+
+  if _executor is None:
+    _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+  return _executor
+
+
+class SpotifyError(Exception):
+  """
+  Raised when the Spotify API returns a non-200 status code,
+  or cannot be reached in time (status code 504).
+  """
+
+  def __init__(self, status_code, message=None):
+    if message is None:
+      message = f"Spotify API returned status code {status_code}"
+    super().__init__(message)
+    self.status_code = status_code
+
+
+def auth_headers(spotify_token):
+  """
+  Builds the request headers for calls to the Spotify API
+
+  Parameters
+  ----------
+  spotify_token: Spotify API access token
+
+  Returns
+  -------
+  dictionary of HTTP headers
+  """
+  return {
+    'Authorization': "Bearer " + spotify_token,
+    'Content-Type': 'application/json'
+  }
+
+
+def parse_music_id(musicid, kind=None):
+  """
+  Splits a Spotify URI or URL into its id and kind, e.g.
+  "spotify:track:abc" or "https://open.spotify.com/album/abc".
+  Plain ids are returned unchanged with the kind passed in.
+
+  Parameters
+  ----------
+  musicid: Spotify id, URI or URL
+  kind: optional "track" or "album" supplied by the caller
+
+  Returns
+  -------
+  (musicid, kind) where kind is "track", "album" or None
+  if unknown; raises ValueError if a kind is given (or in
+  the URI / URL) but is not "track" or "album"
+  """
+  musicid = musicid.strip()
+  kind = kind or None
+
+  if musicid.startswith("spotify:"):
+    parts = musicid.split(":")
+    if len(parts) == 3:
+      kind, musicid = parts[1], parts[2]
+
+  elif musicid.startswith("https://open.spotify.com/"):
+    parts = musicid.split("?")[0].rstrip("/").split("/")
+    kind, musicid = parts[-2], parts[-1]
+
+  if kind not in (None, "track", "album"):
+    raise ValueError(f"unknown kind '{kind}', expected track or album")
+
+  return (musicid, kind)
+
+
+def error_response(status_code):
+  """
+  Maps a Spotify API status code to the lambda response
+  returned to the client.
+
+  Parameters
+  ----------
+  status_code: HTTP status code returned by Spotify
+
+  Returns
+  -------
+  lambda response dictionary
+  """
+  if status_code == 401:
+    msg = "error: Spotify API has a bad or expired token"
+  elif status_code == 403:
+    msg = "error: Spotify API has bad OAuth request"
+  elif status_code == 429:
+    msg = "error: Spotify API rate limit exceeded"
+  elif status_code == TIMEOUT_STATUS_CODE:
+    msg = "error: Spotify API timed out"
+  else:
+    msg = "error: Spotify API error"
+
+  return {
+    'statusCode': status_code,
+    'body': json.dumps(msg)
+  }
+
+
+def set_deadline(context):
+  """
+  Limits retries to the time this invocation has left, so
+  backing off never runs the lambda into its timeout: a
+  retry that would end past the deadline is dropped and
+  the error response returned instead. Every handler that
+  calls Spotify calls this first; pass None (e.g. when run
+  from the command line) for no limit.
+  """
+  global _deadline
+
+  if context is None:
+    _deadline = None
+  else:
+    _deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - DEADLINE_MARGIN
+
+
+def _backoff(response, attempt):
+  #
+  # honor Retry-After when Spotify sends it, otherwise back
+  # off exponentially; either way add jitter so throttled
+  # threads don't all retry at the same instant. Returns
+  # None if we can't afford to wait as long as Spotify
+  # asks, or past the invocation's deadline:
+  #
+  retry_after = response.headers.get("Retry-After") if response is not None else None
+
+  if retry_after is not None and retry_after.isdigit():
+    delay = float(retry_after)
+
+    if delay > MAX_BACKOFF:
+      return None
+  else:
+    delay = min(MAX_BACKOFF, 0.5 * (2 ** attempt))
+
+  delay = min(MAX_BACKOFF, delay + random.uniform(0, delay / 2 + 0.1))
+
+  if _deadline is not None and time.monotonic() + delay > _deadline:
+    return None
+
+  return delay
+
+
+def get(url, headers, params=None):
+  """
+  Sends a GET request to the Spotify API through the shared
+  rate limiter, retrying throttled and failed calls
+
+  Parameters
+  ----------
+  url: Spotify API url
+  headers: request headers from auth_headers()
+  params: optional query string parameters
+
+  Returns
+  -------
+  the final requests.Response; its status code may still be
+  an error if the retries were exhausted. Raises SpotifyError
+  if Spotify could not be reached in time.
+  """
+  attempt = 0
+
+  while True:
+    _bucket.acquire()
+
+    with _limit:
+      _count("requests")
+      start = time.perf_counter()
+      try:
+        response = session.get(url, headers=headers, params=params, timeout=TIMEOUT)
+        failure = None
+      except (requests.Timeout, requests.ConnectionError) as err:
+        response = None
+        failure = err
+      _record_latency(url, (time.perf_counter() - start) * 1000)
+
+    if response is not None and response.status_code not in RETRY_STATUS_CODES:
+      _limit.succeeded()
+      return response
+
+    if response is not None and response.status_code == 429:
+      _count("throttled")
+      _limit.throttled()
+
+    delay = None if attempt >= MAX_RETRIES else _backoff(response, attempt)
+
+    if delay is None:
+      _count("dropped")
+      if failure is not None:
+        raise SpotifyError(TIMEOUT_STATUS_CODE, f"Spotify API unreachable: {failure}")
+      return response
+
+    _count("retried")
+    time.sleep(delay)
+    attempt += 1
+
+
+def get_json(url, headers, params=None):
+  """
+  Sends a GET request to the Spotify API via get() and
+  returns the decoded body
+
+  Parameters
+  ----------
+  url: Spotify API url
+  headers: request headers from auth_headers()
+  params: optional query string parameters
+
+  Returns
+  -------
+  the JSON response body; raises SpotifyError if Spotify
+  did not return 200
+  """
+  response = get(url, headers, params)
+
+  if response.status_code != 200:
+    raise SpotifyError(response.status_code)
+
+  return response.json()
+
+
+def log_stats():
+  """
+  Prints the Spotify call counters and per-endpoint latency
+  histograms for this container
+  """
+  print(f"**spotify: requests={stats['requests']} throttled={stats['throttled']} "
+        f"retried={stats['retried']} dropped={stats['dropped']} "
+        f"concurrency={_limit.limit}/{_limit.maximum}**")
+
+  labels = [f"<{bound}ms" for bound in LATENCY_BUCKETS] + [f">={LATENCY_BUCKETS[-1]}ms"]
+
+  for endpoint, counts in sorted(latencies.items()):
+    buckets = " ".join(f"{label}={count}" for (label, count) in zip(labels, counts) if count)
+    print(f"**spotify latency {endpoint}: {buckets}**")
+
+
+def get_several(kind, ids, headers):
+  """
+  Looks up many Spotify objects of one kind using the
+  multi-id endpoints, e.g. /v1/tracks?ids=a,b,c. Ids are
+  sent in chunks no larger than Spotify allows.
+
+  Parameters
+  ----------
+  kind: "tracks", "albums" or "artists"
+  ids: iterable of Spotify ids
+  headers: request headers from auth_headers()
+
+  Returns
+  -------
+  dictionary mapping id => Spotify object, ids that Spotify
+  could not resolve as this kind are left out
+  """
+  ids = list(dict.fromkeys(ids))  # de-duplicate, keep order
+  batch_size = BATCH_SIZES[kind]
+
+  chunks = [ids[start:start + batch_size] for start in range(0, len(ids), batch_size)]
+
+  def fetch(chunk):
+    url = f"https://api.spotify.com/v1/{kind}"
+    return get_json(url, headers, params={"ids": ",".join(chunk)})[kind]
+
+  #
+  # fetch the chunks concurrently, then assemble the results
+  # in request order once they have all come back:
+  #
+  if len(chunks) > 1:
+    results = list(_get_executor().map(fetch, chunks))
+  else:
+    results = [fetch(chunk) for chunk in chunks]
+
+  found = {}
+
+  for chunk, items in zip(chunks, results):
+    #
+    # Spotify returns null in place of any id it could
+    # not find:
+    #
+    for musicid, item in zip(chunk, items):
+      if item is not None:
+        found[musicid] = item
+
+  return found
@@ -0,0 +1,109 @@
+#
+# Deletes expired rows from the tokens table. Meant to run
+# on a schedule (e.g. an EventBridge rule every hour); each
+# run deletes in batches of SWEEP_BATCH_SIZE rows, committing
+# after every batch so locks are held briefly, and stops when
+# nothing is left or the SWEEP_TIME_BUDGET (seconds) is spent.
+# Whatever remains is picked up by the next run.
+#
+# An expired token is rejected by auth_utils whether or not
+# its row still exists, so this includes revoked rows: once
+# a token has expired, its revocation no longer matters.
+#
+
+import json
+import os
+import time
+import datatier
+import settings
+import db_utils
+
+
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "1000"))
+SWEEP_TIME_BUDGET = float(os.getenv("SWEEP_TIME_BUDGET", "30"))
+
+#
+# one batch; also EXPLAINed by check_query_plans.py:
+#
+SWEEP_SQL = """
+  DELETE FROM tokens
+  WHERE expiration_utc < UTC_TIMESTAMP()
+  LIMIT %s
+  """
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: sweep_tokens**")
+
+    #
+    # configuration, read once per container (see
+    # settings.py):
+    #
+    config = settings.get()
+
+    #
+    # never run past the lambda's own timeout; keep a couple
+    # of seconds back to report:
+    #
+    budget = SWEEP_TIME_BUDGET
+
+    if context is not None:
+      budget = min(budget, context.get_remaining_time_in_millis() / 1000 - 2)
+
+    #
+    # open connection to the database:
+    #
+    print("**Opening connection**")
+
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
+
+    #
+    # delete in bounded batches until done or out of time:
+    #
+    print("**Deleting expired tokens**")
+
+    start = time.monotonic()
+    deleted = 0
+    batches = 0
+
+    while time.monotonic() - start < budget:
+      modified = datatier.perform_action(dbConn, SWEEP_SQL, [SWEEP_BATCH_SIZE])
+      batches += 1
+
+      if modified <= 0:
+        break
+
+      deleted += modified
+
+      if modified < SWEEP_BATCH_SIZE:
+        break
+
+    elapsed = time.monotonic() - start
+
+    print("deleted:", deleted, "rows in", batches, "batches,", round(elapsed, 3), "secs")
+    print("**DONE, returning counts**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps({"deleted": deleted,
+                          "batches": batches,
+                          "elapsed_secs": round(elapsed, 3)})
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
+
+
+#
+# allow running from the command line as well:
+#
+if __name__ == "__main__":
+  print(lambda_handler({}, None))
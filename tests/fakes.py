@@ -0,0 +1,32 @@
+#
+# Stand-ins for Spotify shared by the tests: a session that
+# answers the multi-id endpoints locally, optionally after
+# an injected delay, and counts the calls it gets.
+#
+
+import threading
+import time
+
+
+class FakeResponse:
+  def __init__(self, kind, ids):
+    self.status_code = 200
+    self.headers = {}
+    self._body = {kind: [{"id": musicid} for musicid in ids]}
+
+  def json(self):
+    return self._body
+
+
+class FakeSession:
+  def __init__(self, latency=0.0):
+    self.latency = latency  # seconds per call
+    self.calls = 0
+    self._lock = threading.Lock()
+
+  def get(self, url, headers=None, params=None, timeout=None):
+    with self._lock:
+      self.calls += 1
+    if self.latency:
+      time.sleep(self.latency)
+    return FakeResponse(url.rsplit("/", 1)[-1], params["ids"].split(","))
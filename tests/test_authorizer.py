@@ -0,0 +1,134 @@
+#
+# Runs auth.authorizer_handler against the local event
+# fixtures in tests/events, with the database replaced by
+# fakes, and checks the cache and revocation paths.
+#
+# python -m unittest discover tests
+#
+# auth.py needs the Lambda layer (datatier, api_utils) and
+# bcrypt; without them these tests are skipped.
+#
+
+import datetime
+import json
+import os
+import time
+import unittest
+from unittest import mock
+
+try:
+  import auth
+  import auth_utils
+  import ttl_cache
+except ImportError as err:
+  raise unittest.SkipTest(f"auth.py dependencies missing: {err}")
+
+
+EVENTS = os.path.join(os.path.dirname(__file__), "events")
+
+TOKEN = "6f1c2d3e-0000-4000-8000-00000000002a"
+
+
+def load_event(name):
+  with open(os.path.join(EVENTS, name)) as f:
+    return json.load(f)
+
+
+class AuthorizerTest(unittest.TestCase):
+  def setUp(self):
+    #
+    # fresh caches and revocation state for every test:
+    #
+    for (module, name) in [(auth, "authorizer_cache"),
+                           (auth_utils, "_rejected"),
+                           (auth_utils, "_failures")]:
+      patcher = mock.patch.object(module, name, ttl_cache.TTLCache(name, 100, 300))
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+    for (name, value) in [("_revoked", set()), ("_revoked_loaded_at", None)]:
+      patcher = mock.patch.object(auth_utils, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+    self.connects = 0
+    self.revoked_rows = []
+
+    def connect():
+      self.connects += 1
+      return object()
+
+    expiration_utc = datetime.datetime.utcnow() + datetime.timedelta(minutes=30)
+
+    self.retrieve_one_row = mock.Mock(return_value=(42, expiration_utc, 0))
+
+    for (module, name, value) in [
+        (auth, "_dbConn", connect),
+        (auth_utils.datatier, "retrieve_one_row", self.retrieve_one_row),
+        (auth_utils.datatier, "retrieve_all_rows", lambda dbConn, sql, *args: self.revoked_rows)]:
+      patcher = mock.patch.object(module, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def test_token_event_allows(self):
+    policy = auth.authorizer_handler(load_event("authorizer_token.json"), None)
+
+    self.assertEqual(policy["principalId"], "42")
+    self.assertEqual(policy["context"], {"userid": 42})
+    self.assertEqual(policy["policyDocument"]["Statement"][0]["Resource"],
+                     "arn:aws:execute-api:us-east-2:123456789012:abcdef1234/prod/*")
+
+  def test_request_event_allows(self):
+    policy = auth.authorizer_handler(load_event("authorizer_request.json"), None)
+
+    self.assertEqual(policy["context"], {"userid": 42})
+
+  def test_missing_token_denied_without_database(self):
+    event = load_event("authorizer_request.json")
+    event["headers"] = {}
+
+    with self.assertRaisesRegex(Exception, "Unauthorized"):
+      auth.authorizer_handler(event, None)
+
+    self.assertEqual(self.connects, 0)
+
+  def test_cache_hit_needs_no_connection(self):
+    #
+    # the first hit loads the revoked set; later hits within
+    # REVOCATION_REFRESH use it as is:
+    #
+    event = load_event("authorizer_token.json")
+    auth.authorizer_handler(event, None)
+    auth.authorizer_handler(event, None)
+
+    connects = self.connects
+
+    for _ in range(10):
+      self.assertEqual(auth.authorizer_handler(event, None)["principalId"], "42")
+
+    self.assertEqual(self.retrieve_one_row.call_count, 1)
+    self.assertEqual(self.connects, connects)
+
+  def test_revoked_token_denied_on_cache_hit(self):
+    event = load_event("authorizer_token.json")
+    auth.authorizer_handler(event, None)
+
+    #
+    # revoked in another container; seen once the revoked
+    # set is next refreshed:
+    #
+    self.revoked_rows = [(TOKEN,)]
+    auth_utils._revoked_loaded_at = time.monotonic() - auth_utils.REVOCATION_REFRESH
+
+    with self.assertRaisesRegex(Exception, "Unauthorized"):
+      auth.authorizer_handler(event, None)
+
+  def test_downstream_reads_userid(self):
+    event = load_event("authorized_request.json")
+
+    self.assertEqual(auth_utils.authorized_userid(event), 42)
+    self.assertIsNone(auth_utils.authorized_userid({}))
+
+
+if __name__ == "__main__":
+  unittest.main()
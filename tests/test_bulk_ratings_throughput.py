@@ -0,0 +1,123 @@
+#
+# Throughput check for bulk rating ingestion in
+# create_rating: imports RATINGS ratings one request at a
+# time, then as one bulk request, against a fake database
+# where every round trip (statement, commit, rollback)
+# takes ROUND_TRIP seconds, and checks the bulk path is at
+# least 50x faster. Only database round trips are charged;
+# the API Gateway and Lambda overhead the per-item path
+# also pays per rating is left out.
+#
+# python -m unittest discover tests
+#
+
+import datetime
+import json
+import time
+import unittest
+from unittest import mock
+
+try:
+  import create_rating
+  import settings
+except ImportError as err:
+  raise unittest.SkipTest(f"create_rating dependencies missing: {err}")
+
+
+ROUND_TRIP = 0.001  # seconds
+RATINGS = 200
+
+TOKEN = "6f1c2d3e-0000-4000-8000-00000000002a"
+
+CONFIG = settings.Settings(config_file="test.ini", rds_endpoint="localhost", rds_portnum=3306,
+                           rds_username="admin", rds_pwd="secret", rds_dbname="musicapp",
+                           metadata_ttl=settings.DEFAULT_METADATA_TTL)
+
+
+class FakeCursor:
+  def __init__(self, connection):
+    self.connection = connection
+    self.rowcount = 0
+
+  def execute(self, sql, parameters=None):
+    self.connection.round_trip()
+    self.rowcount = sql.count("(%s, %s, %s, %s, %s)") or 1
+
+  def close(self):
+    pass
+
+
+class FakeConnection:
+  def __init__(self):
+    self.round_trips = 0
+    self.ratings = 0
+
+  def round_trip(self):
+    self.round_trips += 1
+    time.sleep(ROUND_TRIP)
+
+  def cursor(self):
+    return FakeCursor(self)
+
+  def commit(self):
+    self.round_trip()
+
+  def rollback(self):
+    self.round_trip()
+
+
+class BulkThroughputTest(unittest.TestCase):
+  def setUp(self):
+    self.dbConn = FakeConnection()
+
+    def retrieve_one_row(dbConn, sql, parameters=None):
+      self.dbConn.round_trip()
+      return (42, datetime.datetime.utcnow() + datetime.timedelta(minutes=30), 0)
+
+    def retrieve_all_rows(dbConn, sql, parameters=None):
+      self.dbConn.round_trip()
+      return []
+
+    for (module, name, value) in [
+        (create_rating.settings, "get", lambda *args: CONFIG),
+        (create_rating.db_utils, "get_dbConn", lambda *args: self.dbConn),
+        (create_rating.auth_utils.datatier, "retrieve_one_row", retrieve_one_row),
+        (create_rating.music_metadata.datatier, "retrieve_all_rows", retrieve_all_rows)]:
+      patcher = mock.patch.object(module, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def rate(self, body):
+    event = {"pathParameters": {"token": TOKEN}, "body": json.dumps(body)}
+    response = create_rating.lambda_handler(event, None)
+    self.assertEqual(response["statusCode"], 200, response)
+    return response
+
+  def test_bulk_is_50x_faster(self):
+    items = [{"musicid": f"spotify:track:{i:022d}", "num_stars": i % 5 + 1, "comment": ""}
+             for i in range(RATINGS)]
+
+    start = time.perf_counter()
+    for item in items:
+      self.rate(item)
+    per_item = time.perf_counter() - start
+    per_item_trips = self.dbConn.round_trips
+
+    self.dbConn.round_trips = 0
+
+    start = time.perf_counter()
+    response = self.rate({"ratings": items})
+    bulk = time.perf_counter() - start
+
+    results = json.loads(response["body"])["results"]
+    self.assertEqual([result["status"] for result in results], ["ok"] * RATINGS)
+
+    print(f"\n{RATINGS} ratings: per-item {per_item * 1000:.0f} ms "
+          f"({per_item_trips} round trips), bulk {bulk * 1000:.0f} ms "
+          f"({self.dbConn.round_trips} round trips), speedup {per_item / bulk:.0f}x")
+
+    self.assertGreaterEqual(per_item / bulk, 50)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,54 @@
+#
+# Checks that music_metadata.hydrate counts one cache hit
+# or miss per id, however many kinds' caches it probes.
+#
+# python -m unittest discover tests
+#
+
+import unittest
+from unittest import mock
+
+try:
+  import music_metadata
+  import ttl_cache
+except ImportError as err:
+  raise unittest.SkipTest(f"music_metadata dependencies missing: {err}")
+
+
+class HydrateCountersTest(unittest.TestCase):
+  def setUp(self):
+    caches = {kind: ttl_cache.TTLCache(kind, 100, 300) for kind in ("tracks", "albums", "artists")}
+
+    for (name, value) in [("_caches", caches), ("lookup", lambda dbConn, musicids, ttl: {})]:
+      patcher = mock.patch.object(music_metadata, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+    self.caches = caches
+
+  def counters(self):
+    return (sum(cache.hits for cache in self.caches.values()),
+            sum(cache.misses for cache in self.caches.values()))
+
+  def test_one_miss_per_unknown_id(self):
+    music_metadata.hydrate(None, ["a", "b", "c"], None)
+
+    self.assertEqual(self.counters(), (0, 3))
+
+  def test_known_kind_probes_one_cache(self):
+    music_metadata.hydrate(None, ["a", "b"], None, known_kinds={"a": "album", "b": "track"})
+
+    self.assertEqual(self.caches["albums"].misses, 1)
+    self.assertEqual(self.caches["tracks"].misses, 1)
+
+  def test_hit_in_second_cache_counts_no_miss(self):
+    self.caches["albums"].put("a", {"musicid": "a", "kind": "album"})
+
+    found = music_metadata.hydrate(None, ["a"], None)
+
+    self.assertIn("a", found)
+    self.assertEqual(self.counters(), (1, 0))
+
+
+if __name__ == "__main__":
+  unittest.main()
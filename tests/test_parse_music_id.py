@@ -0,0 +1,30 @@
+#
+# Checks spotify_utils.parse_music_id on plain ids, URIs
+# and URLs, and that an unknown kind is refused rather than
+# stored as NULL.
+#
+# python -m unittest discover tests
+#
+
+import unittest
+
+import spotify_utils
+
+
+class ParseMusicIdTest(unittest.TestCase):
+  def test_forms(self):
+    self.assertEqual(spotify_utils.parse_music_id("abc"), ("abc", None))
+    self.assertEqual(spotify_utils.parse_music_id("abc", "album"), ("abc", "album"))
+    self.assertEqual(spotify_utils.parse_music_id(" spotify:track:abc "), ("abc", "track"))
+    self.assertEqual(spotify_utils.parse_music_id("https://open.spotify.com/album/abc?si=x"),
+                     ("abc", "album"))
+
+  def test_unknown_kind(self):
+    for (musicid, kind) in [("abc", "song"), ("spotify:artist:abc", None),
+                            ("https://open.spotify.com/playlist/abc", None)]:
+      with self.assertRaisesRegex(ValueError, "unknown kind"):
+        spotify_utils.parse_music_id(musicid, kind)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,63 @@
+#
+# Checks that settings.get() reads the config file once per
+# container, and not at all on warm calls.
+#
+# python -m unittest discover tests
+#
+
+import builtins
+import os
+import tempfile
+import unittest
+from configparser import ConfigParser
+from unittest import mock
+
+import settings
+
+
+CONFIG = """
+[rds]
+endpoint = localhost
+port_number = 3306
+user_name = admin
+user_pwd = secret
+db_name = musicapp
+"""
+
+
+class SettingsTest(unittest.TestCase):
+  def setUp(self):
+    with tempfile.NamedTemporaryFile("w", suffix=".ini", delete=False) as f:
+      f.write(CONFIG)
+    self.config_file = f.name
+    self.addCleanup(os.remove, self.config_file)
+    self.addCleanup(settings._settings.clear)
+
+    # load() sets AWS_SHARED_CREDENTIALS_FILE; put it back after
+    environ = mock.patch.dict(os.environ)
+    environ.start()
+    self.addCleanup(environ.stop)
+
+  def test_warm_calls_read_nothing(self):
+    read = mock.patch.object(ConfigParser, "read", autospec=True, side_effect=ConfigParser.read)
+    opened = mock.patch.object(builtins, "open", side_effect=builtins.open)
+
+    with read as read_mock, opened as open_mock:
+      first = settings.get(self.config_file)
+      self.assertEqual(read_mock.call_count, 1)
+      self.assertGreater(open_mock.call_count, 0)
+      self.assertEqual(first.rds_dbname, "musicapp")
+      self.assertEqual(first.metadata_ttl, settings.DEFAULT_METADATA_TTL)
+
+      read_mock.reset_mock()
+      open_mock.reset_mock()
+
+      for _ in range(100):
+        self.assertIs(settings.get(self.config_file), first)
+
+      self.assertEqual(read_mock.call_count, 0)
+      self.assertEqual(open_mock.call_count, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,39 @@
+#
+# Checks that spotify_utils.get_several sends O(N / batch
+# size) requests, with a fake session in place of Spotify.
+#
+# python -m unittest discover tests
+#
+
+import math
+import unittest
+from unittest import mock
+
+import spotify_utils
+
+from fakes import FakeSession
+
+
+class GetSeveralTest(unittest.TestCase):
+  def check(self, kind, n):
+    ids = [f"id{i}" for i in range(n)]
+    fake = FakeSession()
+
+    with mock.patch.object(spotify_utils, "session", fake):
+      found = spotify_utils.get_several(kind, ids + ids[:10], {})
+
+    self.assertEqual(set(found), set(ids))
+    self.assertEqual(fake.calls, math.ceil(n / spotify_utils.BATCH_SIZES[kind]))
+
+  def test_tracks(self):
+    self.check("tracks", 1000)
+
+  def test_albums(self):
+    self.check("albums", 95)
+
+  def test_single_batch(self):
+    self.check("artists", 50)
+
+
+if __name__ == "__main__":
+  unittest.main()
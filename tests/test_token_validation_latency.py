@@ -0,0 +1,102 @@
+#
+# Benchmark for in-process token validation: compares the
+# p50/p99 latency of the old path --- POST /auth to the
+# authentication service, then a second SELECT on tokens
+# for the userid --- with one auth_utils.validate_token
+# call on the handler's own connection. The service is a
+# local HTTP server and every query takes QUERY_LATENCY,
+# so the numbers leave out the Lambda cold starts and RDS
+# connects that the old path also paid.
+#
+# python -m unittest discover tests
+#
+
+import datetime
+import http.server
+import statistics
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+try:
+  import auth_utils
+except ImportError as err:
+  raise unittest.SkipTest(f"auth_utils dependencies missing: {err}")
+
+
+QUERY_LATENCY = 0.002  # seconds per query
+REQUESTS = 200
+
+TOKEN = "6f1c2d3e-0000-4000-8000-00000000002a"
+
+
+def query(dbConn, sql, parameters=None):
+  time.sleep(QUERY_LATENCY)
+  return (42, datetime.datetime.utcnow() + datetime.timedelta(minutes=30), 0)
+
+
+class AuthService(http.server.BaseHTTPRequestHandler):
+  #
+  # stands in for POST /auth: one token lookup, then 200
+  #
+  def do_POST(self):
+    self.rfile.read(int(self.headers["Content-Length"]))
+    query(None, "SELECT ...")
+    self.send_response(200)
+    self.send_header("Content-Length", "2")
+    self.end_headers()
+    self.wfile.write(b"{}")
+
+  def log_message(self, *args):
+    pass
+
+
+def percentiles(samples):
+  cuts = statistics.quantiles(samples, n=100)
+  return (cuts[49] * 1000, cuts[98] * 1000)  # ms
+
+
+class ValidationLatencyBenchmark(unittest.TestCase):
+  def setUp(self):
+    self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), AuthService)
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+
+    self.url = f"http://127.0.0.1:{self.server.server_port}/auth"
+
+  def time_calls(self, call):
+    samples = []
+    for _ in range(REQUESTS):
+      start = time.perf_counter()
+      call()
+      samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+  def test_in_process_is_faster(self):
+    def before():
+      response = requests.post(self.url, json={"token": TOKEN})
+      self.assertEqual(response.status_code, 200)
+      query(None, "SELECT userid FROM tokens WHERE token = %s", TOKEN)
+
+    def after():
+      (userid, expiration_utc) = auth_utils.validate_token(None, TOKEN)
+      self.assertEqual(userid, 42)
+
+    with mock.patch.object(auth_utils.datatier, "retrieve_one_row", query):
+      (before_p50, before_p99) = self.time_calls(before)
+      (after_p50, after_p99) = self.time_calls(after)
+
+    print(f"\nPOST /auth + SELECT: p50 {before_p50:.2f} ms, p99 {before_p99:.2f} ms; "
+          f"validate_token: p50 {after_p50:.2f} ms, p99 {after_p99:.2f} ms")
+
+    # p99 is reported but not asserted; it is noisy on a
+    # shared machine:
+    self.assertLess(after_p50, before_p50)
+
+
+if __name__ == "__main__":
+  unittest.main()
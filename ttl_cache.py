@@ -0,0 +1,105 @@
+#
+# Size-bounded LRU cache with a per-entry time to live.
+#
+# Caches are created at module scope, so they survive
+# across invocations while Lambda keeps the container warm.
+#
+
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class TTLCache:
+  """
+  Least-recently-used cache whose entries also expire
+  ttl seconds after they were stored. Safe to share
+  between threads.
+  """
+
+  def __init__(self, name, maxsize, ttl):
+    self.name = name
+    self.maxsize = maxsize
+    self.ttl = ttl
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    self._entries = OrderedDict()  # key => (expires_at, value)
+    self._lock = threading.Lock()
+
+  def get(self, key, default=None, count_miss=True):
+    """
+    Returns the cached value for key, or default if the key
+    is not cached or has expired. Pass count_miss=False when
+    probing several caches for one key, so a lookup counts
+    at most one miss.
+    """
+    with self._lock:
+      if key in self._entries:
+        expires_at, value = self._entries[key]
+
+        if time.monotonic() < expires_at:
+          self._entries.move_to_end(key)
+          self.hits += 1
+          return value
+
+        del self._entries[key]
+
+      if count_miss:
+        self.misses += 1
+      return default
+
+  def put(self, key, value):
+    """
+    Stores value under key, evicting the least recently
+    used entry if the cache is full
+    """
+    with self._lock:
+      self._entries[key] = (time.monotonic() + self.ttl, value)
+      self._entries.move_to_end(key)
+
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def __len__(self):
+    return len(self._entries)
+
+
+#
+# every cache created through get_cache(), by name:
+#
+_caches = {}
+
+
+def get_cache(name, maxsize, ttl):
+  """
+  Returns the module-scope cache with the given name,
+  creating it on first use
+
+  Parameters
+  ----------
+  name: cache name, used in the logs
+  maxsize: maximum number of entries
+  ttl: seconds an entry stays valid
+
+  Returns
+  -------
+  TTLCache object
+  """
+  if name not in _caches:
+    _caches[name] = TTLCache(name, maxsize, ttl)
+
+  return _caches[name]
+
+
+def log_stats():
+  """
+  Prints hit/miss/eviction counters for every cache
+  """
+  for cache in _caches.values():
+    print(f"**cache {cache.name}: size={len(cache)} hits={cache.hits} "
+          f"misses={cache.misses} evictions={cache.evictions}**")
@@ -7,23 +7,26 @@ import json
 import boto3
 import os
 import datatier
-import requests
+import settings
+import db_utils
+import auth_utils
+import spotify_utils
+import music_metadata
+import user_stats_agg
+import ttl_cache
 
-from configparser import ConfigParser
 
 def lambda_handler(event, context):
   try:
     print("**STARTING**")
+    spotify_utils.set_deadline(context)
     print("**lambda: user_stats_allears**")
     
     #
-    # setup AWS based on config file:
+    # configuration, read once per container (see
+    # settings.py):
     #
-    config_file = 'musicapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
+    config = settings.get()
     
     #
     # configure for S3 access:
@@ -36,14 +39,6 @@ def lambda_handler(event, context):
     #s3 = boto3.resource('s3')
     #bucket = s3.Bucket(bucketname)
     
-    #
-    # configure for RDS access
-    #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
 
     #
     # userid from event: could be a parameter
@@ -62,13 +57,6 @@ def lambda_handler(event, context):
       }
 
 
-    #
-    # open connection to the database:
-    #
-    print("**Opening connection**")
-    
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
-    
     #
     # get authentication token from request headers:
     #
@@ -84,7 +72,7 @@ def lambda_handler(event, context):
     
     headers = event["headers"]
       
-    if "Authentication" not in headers:
+    if "Authentication" not in headers and auth_utils.authorized_userid(event) is None:
       msg = "no security credentials"
       print("**ERROR:", msg)
       return {
@@ -92,144 +80,76 @@ def lambda_handler(event, context):
         'body': json.dumps(headers)
       }
     
-    token = headers['Authentication']
-    
+    token = headers.get('Authentication')
     
     #
-    # is the token valid? Ask the authentication service...
+    # requests that came through the authorizer already
+    # carry the userid; otherwise turn away recently
+    # rejected tokens before doing any database work:
     #
-    auth_url = configur.get('auth', 'webservice')
-    data = {"token": token}
-    
-    api = '/auth'
-    url = auth_url + api
+    userid = auth_utils.authorized_userid(event)
     
-    response = requests.post(url, json=data)
+    if userid is None:
+      try:
+        auth_utils.check_token(token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return {
+          'statusCode': 401,
+          'body': json.dumps(msg)
+        }
     
-    if response.status_code != 200:
-      msg = "authentication failure"
-      print("**ERROR:", msg)
-      return {
-        'statusCode': 401,
-        'body': json.dumps(msg)
-      }
+    #
+    # open connection to the database:
+    #
+    print("**Opening connection**")
     
+    dbConn = db_utils.get_dbConn(config.rds_endpoint, config.rds_portnum, config.rds_username, config.rds_pwd, config.rds_dbname)
     
     
     #
-    # retrieve userid from tokens
+    # is the token valid? Check it against the tokens table,
+    # which also tells us who the user is:
     #
-    user_sql = "SELECT userid FROM tokens WHERE token = %s"
-    user_info = datatier.retrieve_one_row(dbConn, user_sql, token)
-    userid = user_info[0]
+    if userid is None:
+      try:
+        (userid, expiration_utc) = auth_utils.validate_token(dbConn, token)
+      except auth_utils.AuthError as err:
+        msg = "authentication failure"
+        print("**ERROR:", msg, "-", str(err))
+        return {
+          'statusCode': 401,
+          'body': json.dumps(msg)
+        }
     
     
     #
-    # now retrieve all the user ratings:
+    # read the incrementally maintained aggregates, and
+    # rebuild them from the ratings table if they are
+    # missing or stale:
     #
-    sql = """ SELECT * FROM ratings WHERE userid = %s ORDER BY num_stars DESC"""
-
-    rows = datatier.retrieve_all_rows(dbConn, sql, userid)
-    if not rows:
+    stats = user_stats_agg.read(dbConn, userid)
+    
+    if stats is None:
+      print("**Aggregates missing or stale, rebuilding**")
+      
+      headers = spotify_utils.auth_headers(spotify_token)
+      
+      metadata_ttl = config.metadata_ttl
+      
+      try:
+        stats = user_stats_agg.rebuild(dbConn, userid, headers, metadata_ttl)
+      except spotify_utils.SpotifyError as err:
+        return spotify_utils.error_response(err.status_code)
+    
+    if not stats:
       msg = "user has not ratings"
       print(msg)
       return {
         'statusCode': 200,
         'body': json.dumps(msg)
       }
-    print(rows)
-    
-    stats = {}
-    
-    # Calculate average rating
-    total_stars = sum(row[3] for row in rows)
-    average_rating = total_stars / len(rows)
-    stats['average_rating'] = average_rating
-    
-        
-    # get top artists and top genres:
-    
-    # Make the request to Spotify API with the provided token
-    headers = {
-        'Authorization': "Bearer " + spotify_token,
-        'Content-Type': 'application/json'
-    }
-    
-    
-    # Aggregate data for highest-rated albums, tracks, artists, and genres
-    albums = {}
-    artists = {}
-    genres = {}
-    tracks = {}
-
-    for row in rows:
-        musicid = row[2]
-
-        # Get track details
-        url = f"https://api.spotify.com/v1/tracks/{musicid}"
-        response = requests.get(url, headers=headers)
-        data = response.json()
-
-        if response.status_code != 200:
-            # Maybe an album?
-            url = f"https://api.spotify.com/v1/albums/{musicid}"
-            response = requests.get(url, headers=headers)
-            data = response.json()
-            
-            # fail!
-            if response.status_code != 200:
-                if response.status_code == 401:
-                    return {
-                        'statusCode': response.status_code,
-                        'body': json.dumps("error: Spotify API has a bad or expired token")
-                    }
-                if response.status_code == 403:
-                    return {
-                        'statusCode': response.status_code,
-                        'body': json.dumps("error: Spotify API has bad OAuth request")
-                    }
-                return {
-                    'statusCode': response.status_code,
-                    'body': json.dumps("error: Spotify API error")
-                }
-            album_name = data['name']
-            albums[album_name] = albums.get(album_name, 0) + int(row[3])
-            for artist in data['artists']:
-              artist_name = artist['name']
-              artists[artist_name] = artists.get(artist_name, 0) + int(row[3])
-              
-            if 'genres' in data:
-                for genre in data['genres']:
-                    genres[genre] = genres.get(genre, 0) + int(row[3])
-        
-        else:
-          track_name = data['name']
-          tracks[track_name] = tracks.get(track_name, 0) + int(row[3])
-          album_name = data['album']['name']
-          albums[album_name] = albums.get(album_name, 0) + int(row[3])
-          for artist in data['artists']:
-            artist_name = artist['name']
-            artists[artist_name] = artists.get(artist_name, 0) + int(row[3])
-            
-          album_id = data['album']['id']
-          # Get album to get album genres
-          url = f"https://api.spotify.com/v1/albums/{album_id}"
-
-          response = requests.get(url, headers=headers)
-          album_data = response.json()
-          if 'genres' in album_data:
-              for genre in album_data['genres']:
-                  genres[genre] = genres.get(genre, 0) + int(row[3])
-
-    
-    
-    
-    # Sort and get top-5-rated albums, artists, and genres
-    stats['top_albums'] = sorted(albums.items(), key=lambda x: x[1], reverse=True)[:5]
-    stats['top_artists'] = sorted(artists.items(), key=lambda x: x[1], reverse=True)[:5]
-    stats['top_genres'] = sorted(genres.items(), key=lambda x: x[1], reverse=True)[:5]
-    stats['top_tracks'] = sorted(tracks.items(), key=lambda x: x[1], reverse=True)[:5]
-
     
     
     #
@@ -251,3 +171,7 @@ def lambda_handler(event, context):
       'statusCode': 400,
       'body': json.dumps(str(err))
     }
+
+  finally:
+    ttl_cache.log_stats()
+    spotify_utils.log_stats()
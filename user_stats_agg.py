@@ -0,0 +1,373 @@
+#
+# Per-user rating statistics, maintained incrementally in
+# the user_stats_agg and user_stats_counters tables of the
+# MusicApp database.
+#
+# create_rating adds each new rating to the aggregates in
+# the same transaction as the INSERT, so user_stats only
+# has to read the running totals and the top-k counters.
+# When a rating cannot be added incrementally (e.g. its
+# Spotify metadata is unknown) the user's aggregates are
+# marked stale and rebuilt from the ratings table on the
+# next read.
+#
+
+import datatier
+import db_utils
+import music_metadata
+
+
+CATEGORIES = ("album", "artist", "genre", "track")
+
+TOP_K = 5
+
+#
+# width of user_stats_counters.name (see migrations/008);
+# longer names are truncated so the INSERT cannot fail:
+#
+NAME_LENGTH = 512
+
+#
+# read path and rebuild queries, also EXPLAINed by
+# check_query_plans.py. The top-k is one indexed range read
+# per category, served by the (userid, category, weight)
+# index, with parameters [userid, category, k] per category:
+#
+AGGREGATES_SQL = "SELECT star_sum, rating_count, stale FROM user_stats_agg WHERE userid = %s"
+
+TOP_K_SQL = " UNION ALL ".join(["""
+  (SELECT category, name, weight FROM user_stats_counters
+   WHERE userid = %s AND category = %s
+   ORDER BY weight DESC, name LIMIT %s)
+  """] * len(CATEGORIES))
+
+RATINGS_SQL = "SELECT musicid, num_stars, kind FROM ratings WHERE userid = %s"
+
+
+def metadata_for(dbConn, musicids, known_kinds, headers, ttl):
+  """
+  Looks up the rated music, plus the albums and artists
+  needed to resolve genres
+
+  Parameters
+  ----------
+  dbConn: open connection to the MusicApp database
+  musicids: list of rated Spotify ids
+  known_kinds: dictionary musicid => "track" or "album"
+  headers: Spotify request headers, or None to only use
+           stored metadata
+  ttl: music_metadata TTL, in seconds
+
+  Returns
+  -------
+  (metadata, album_metadata, artist_metadata) dictionaries
+  """
+  metadata = music_metadata.hydrate(dbConn, musicids, headers, ttl, known_kinds=known_kinds)
+
+  #
+  # tracks carry no genres, and album genres are usually
+  # empty, so look up each distinct album and artist once
+  # and take genres from both:
+  #
+  album_ids = [entry["album_id"] for entry in metadata.values()
+               if entry["kind"] == "track" and entry["album_id"]]
+  album_metadata = music_metadata.hydrate(dbConn, album_ids, headers, ttl, kinds=("albums",))
+
+  artist_ids = [artist_id for entry in metadata.values() for artist_id in entry["artist_ids"]]
+  artist_metadata = music_metadata.hydrate(dbConn, artist_ids, headers, ttl, kinds=("artists",))
+
+  return (metadata, album_metadata, artist_metadata)
+
+
+def weights_for(ratings, metadata, album_metadata, artist_metadata):
+  """
+  Computes the star-weighted album, artist, genre and track
+  counters for a list of ratings
+
+  Parameters
+  ----------
+  ratings: list of (musicid, num_stars) pairs
+  metadata, album_metadata, artist_metadata: from metadata_for()
+
+  Returns
+  -------
+  (weights, complete) where weights maps category => {name: weight}
+  and complete is False if any rating could not be resolved
+  """
+  weights = {category: {} for category in CATEGORIES}
+  complete = True
+
+  def add(category, name, num_stars):
+    name = name[:NAME_LENGTH]
+    weights[category][name] = weights[category].get(name, 0) + num_stars
+
+  for (musicid, num_stars) in ratings:
+    num_stars = int(num_stars)
+
+    if musicid not in metadata:
+      print("**WARNING: Spotify has no track or album with id", musicid)
+      complete = False
+      continue
+
+    entry = metadata[musicid]
+
+    if entry["kind"] == "track":
+      add("track", entry["name"], num_stars)
+      album_entry = album_metadata.get(entry["album_id"])
+    else:
+      album_entry = entry
+
+    add("album", entry["album"], num_stars)
+    for artist_name in entry["artist_names"]:
+      add("artist", artist_name, num_stars)
+
+    #
+    # each genre of the album or its artists counts once
+    # per rating, weighted by the number of stars:
+    #
+    row_genres = set()
+    if album_entry is not None:
+      row_genres.update(album_entry["genres"])
+    for artist_id in entry["artist_ids"]:
+      if artist_id in artist_metadata:
+        row_genres.update(artist_metadata[artist_id]["genres"])
+      else:
+        complete = False
+
+    for genre in sorted(row_genres):
+      add("genre", genre, num_stars)
+
+  return (weights, complete)
+
+
+def top_k(star_sum, rating_count, weights, k=TOP_K):
+  """
+  Builds the stats dictionary returned by user_stats from
+  in-memory totals and counters
+
+  Returns
+  -------
+  dictionary with average_rating and top_albums, top_artists,
+  top_genres, top_tracks lists of [name, weight]
+  """
+  stats = {"average_rating": star_sum / rating_count}
+
+  for category in CATEGORIES:
+    ranked = sorted(weights[category].items(), key=lambda x: (-x[1], x[0]))[:k]
+    stats[f"top_{category}s"] = [[name, weight] for (name, weight) in ranked]
+
+  return stats
+
+
+def read(dbConn, userid, k=TOP_K):
+  """
+  Reads a user's stats from the aggregate tables
+
+  Parameters
+  ----------
+  dbConn: open connection to the MusicApp database
+  userid: user id
+  k: number of entries in each top list
+
+  Returns
+  -------
+  stats dictionary as from top_k(), {} if the user has no
+  ratings, or None if the aggregates are missing or stale
+  """
+  row = datatier.retrieve_one_row(dbConn, AGGREGATES_SQL, [userid])
+
+  if row == () or row[2]:
+    return None
+
+  star_sum = row[0]
+  rating_count = row[1]
+
+  if rating_count == 0:
+    return {}
+
+  parameters = []
+  for category in CATEGORIES:
+    parameters += [userid, category, k]
+
+  rows = datatier.retrieve_all_rows(dbConn, TOP_K_SQL, parameters)
+
+  stats = {"average_rating": star_sum / rating_count}
+  for category in CATEGORIES:
+    stats[f"top_{category}s"] = []
+
+  for (category, name, weight) in rows:
+    stats[f"top_{category}s"].append([name, weight])
+
+  return stats
+
+
+def _upsert_counters(dbCursor, userid, weights, replace):
+  parameters = []
+  for category in CATEGORIES:
+    for name, weight in weights[category].items():
+      parameters += [userid, category, name, weight]
+
+  if not parameters:
+    return
+
+  placeholders = ", ".join(["(%s, %s, %s, %s)"] * (len(parameters) // 4))
+
+  if replace:
+    update = "weight = VALUES(weight)"
+  else:
+    update = "weight = weight + VALUES(weight)"
+
+  sql = f"""
+        INSERT INTO user_stats_counters (userid, category, name, weight)
+        VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE {update}
+        """
+
+  dbCursor.execute(sql, parameters)
+
+
+def lock(dbCursor, userid):
+  """
+  Locks a user's aggregates row for the rest of the open
+  transaction, creating it (stale) if it does not exist.
+  Every transaction that writes a user's ratings or
+  aggregates takes this lock first, so they all lock in the
+  same order and cannot deadlock with each other.
+  """
+  sql = """
+        INSERT INTO user_stats_agg (userid, star_sum, rating_count, stale)
+        VALUES (%s, 0, 0, 1)
+        ON DUPLICATE KEY UPDATE userid = userid
+        """
+
+  dbCursor.execute(sql, [userid])
+
+
+def increment(dbCursor, userid, star_sum, rating_count, weights):
+  """
+  Adds new ratings to a user's aggregates. Call with the
+  cursor of the transaction that inserts the ratings.
+
+  A user without an aggregates row gets one marked stale,
+  since their earlier ratings are not counted yet.
+
+  Parameters
+  ----------
+  dbCursor: cursor inside the open transaction
+  userid: user id
+  star_sum: total stars of the new ratings
+  rating_count: number of new ratings
+  weights: counters from weights_for()
+
+  Returns
+  -------
+  nothing
+  """
+  sql = """
+        INSERT INTO user_stats_agg (userid, star_sum, rating_count, stale)
+        VALUES (%s, %s, %s, 1)
+        ON DUPLICATE KEY UPDATE
+          star_sum = star_sum + VALUES(star_sum),
+          rating_count = rating_count + VALUES(rating_count)
+        """
+
+  dbCursor.execute(sql, [userid, star_sum, rating_count])
+
+  _upsert_counters(dbCursor, userid, weights, replace=False)
+
+
+def mark_stale(dbCursor, userid):
+  """
+  Flags a user's aggregates for a rebuild on the next read.
+  Call with the cursor of the open transaction.
+  """
+  sql = """
+        INSERT INTO user_stats_agg (userid, star_sum, rating_count, stale)
+        VALUES (%s, 0, 0, 1)
+        ON DUPLICATE KEY UPDATE stale = 1
+        """
+
+  dbCursor.execute(sql, [userid])
+
+
+def rebuild(dbConn, userid, headers, ttl):
+  """
+  Recomputes a user's aggregates from the ratings table and
+  stores them
+
+  Parameters
+  ----------
+  dbConn: open connection to the MusicApp database
+  userid: user id
+  headers: Spotify request headers, or None to only use
+           stored metadata
+  ttl: music_metadata TTL, in seconds
+
+  Returns
+  -------
+  stats dictionary as from top_k(), or {} if the user has
+  no ratings
+  """
+  #
+  # stream the user's ratings, keeping only what the
+  # counters need rather than the whole result set:
+  #
+  ratings = []
+  known_kinds = {}
+
+  for (musicid, num_stars, kind) in db_utils.iter_rows(dbConn, RATINGS_SQL, [userid]):
+    ratings.append((musicid, num_stars))
+    if kind:
+      known_kinds[musicid] = kind
+
+  star_sum = sum(int(num_stars) for (musicid, num_stars) in ratings)
+  rating_count = len(ratings)
+
+  (metadata, album_metadata, artist_metadata) = \
+    metadata_for(dbConn, [musicid for (musicid, num_stars) in ratings], known_kinds, headers, ttl)
+
+  (weights, complete) = weights_for(ratings, metadata, album_metadata, artist_metadata)
+
+  #
+  # swap in the new aggregates, unless ratings were added
+  # while we were talking to Spotify --- then leave them
+  # stale and let the next read try again. Ids that Spotify
+  # itself could not resolve will never resolve, so they
+  # only leave the aggregates stale when Spotify was not
+  # consulted. Lock the aggregates row first, as
+  # create_rating does; the count is then a locking read, so
+  # it sees the latest committed ratings rather than our
+  # transaction's snapshot:
+  #
+  dbCursor = dbConn.cursor()
+  try:
+    lock(dbCursor, userid)
+    dbCursor.execute("SELECT COUNT(*) FROM ratings WHERE userid = %s LOCK IN SHARE MODE", [userid])
+
+    resolved = complete or headers is not None
+    stale = 0 if (resolved and dbCursor.fetchone()[0] == rating_count) else 1
+
+    sql = """
+          INSERT INTO user_stats_agg (userid, star_sum, rating_count, stale)
+          VALUES (%s, %s, %s, %s)
+          ON DUPLICATE KEY UPDATE
+            star_sum = VALUES(star_sum),
+            rating_count = VALUES(rating_count),
+            stale = VALUES(stale)
+          """
+
+    dbCursor.execute(sql, [userid, star_sum, rating_count, stale])
+    dbCursor.execute("DELETE FROM user_stats_counters WHERE userid = %s", [userid])
+    _upsert_counters(dbCursor, userid, weights, replace=True)
+
+    dbConn.commit()
+    dbCursor.close()
+  except Exception:
+    dbConn.rollback()
+    dbCursor.close()
+    raise
+
+  if rating_count == 0:
+    return {}
+
+  return top_k(star_sum, rating_count, weights)